@@ -0,0 +1,475 @@
+import time, mmap, struct, audioop, threading
+import numpy as np
+from collections import deque
+
+try:
+	import pyaudio
+	paInt16 = pyaudio.paInt16
+except ImportError:
+	# Headless boxes: file and synthetic sources still work without it
+	pyaudio = None
+	paInt16 = 8
+
+class AudioSource(object):
+	"""Base class for anything Microphone can read audio from.
+
+	Sources hand out blocks of raw 16-bit audio through read(frames), the
+	same way a PyAudio input stream does, and raise EOFError when they run
+	out. In free-running mode (the default) read() returns as fast as it
+	can; with realtime=True it waits until the wall clock has caught up
+	with the audio, like a real sound card would.
+
+	Subclasses implement readFrames(frames).
+	"""
+	def __init__(self, rate=44100, channels=1, realtime=False):
+		self.rate = rate
+		self.channels = channels
+		self.realtime = realtime
+		self.framesRead = 0 # audio clock, in frames
+		self.startTime = None
+
+	def read(self, frames):
+		"""Read a block of frames as raw 16-bit audio."""
+		block = self.readFrames(frames)
+		self.framesRead += len(block) / (2 * self.channels)
+		if ( self.realtime ):
+			self.pace()
+		return block
+
+	def pace(self):
+		"""Sleep until the wall clock catches up with the audio clock."""
+		now = time.time()
+		if ( self.startTime is None ):
+			self.startTime = now
+		due = self.startTime + self.framesRead / float(self.rate)
+		if ( due > now ):
+			time.sleep(due - now)
+
+	def readFrames(self, frames):
+		error = "Please define your own version of this function in your subclass."
+		raise NotImplementedError(error)
+
+	def close(self):
+		pass
+
+
+class PyAudioSource(AudioSource):
+	"""Live input from a sound card through PyAudio. This is what Microphone
+	used to open by itself.
+
+	The sound card already paces reads, so realtime makes no difference
+	here.
+	"""
+	def __init__(self, rate=44100, channels=2, format=None, device=None):
+		super(PyAudioSource, self).__init__(rate, channels)
+		if ( pyaudio is None ):
+			raise IOError("PyAudio isn't installed; use a file or synthetic source.")
+		self.format = format or paInt16
+		self.device = device
+		self.audio = pyaudio.PyAudio() # new pyAudio root instance
+		self.stream = self.audio.open( format = self.format,
+									   channels = self.channels,
+									   rate = self.rate,
+									   input = True,
+									   input_device_index = device
+									 )
+		self.inputOverflows = 0 # reported by PortAudio in callback mode
+
+	def startCallback(self, onBlock, framesPerBuffer=1024):
+		"""Switch to callback mode: PortAudio calls onBlock(block, timeout)
+		from its own thread for every framesPerBuffer frames captured."""
+		def callback(inData, frameCount, timeInfo, status):
+			if ( status & pyaudio.paInputOverflow ):
+				self.inputOverflows += 1
+			self.framesRead += frameCount
+			onBlock(inData, 0.01) # never hold up the audio thread for long
+			return (None, pyaudio.paContinue)
+
+		# Open the new stream first: if callbacks aren't available, the
+		# blocking one is still there to read from
+		stream = self.audio.open( format = self.format,
+								  channels = self.channels,
+								  rate = self.rate,
+								  input = True,
+								  input_device_index = self.device,
+								  frames_per_buffer = framesPerBuffer,
+								  stream_callback = callback
+								)
+		self.stream.close()
+		self.stream = stream
+
+	def read(self, frames):
+		block = self.stream.read(frames)
+		self.framesRead += frames
+		return block
+
+	def close(self):
+		self.stream.close()
+
+
+class FileSource(AudioSource):
+	"""Reads a WAV file, or headerless raw PCM, through a memory map.
+	Audio is converted to 16-bit mono on the way out, which is what
+	PitchDetect expects.
+
+	For raw files, pass the rate, channels and sample width yourself.
+	loop=True wraps around at the end of the file instead of raising
+	EOFError, which is handy for load tests.
+
+	Example:
+	source = FileSource("rehearsal.wav")
+	source = FileSource("capture.raw", rate=48000, channels=2)
+	"""
+	def __init__(self, path, rate=44100, channels=1, sampleWidth=2,
+				 realtime=False, loop=False):
+		self.path = path
+		self.loop = loop
+		self.file = open(path, "rb")
+		self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+		self.sampleWidth = sampleWidth
+		self.fileChannels = channels
+		self.dataStart, self.dataEnd = 0, len(self.map)
+		if ( self.map[0:4] == "RIFF" and self.map[8:12] == "WAVE" ):
+			rate = self.parseWavHeader()
+		self.frameWidth = self.sampleWidth * self.fileChannels
+		self.frameCount = (self.dataEnd - self.dataStart) / self.frameWidth
+		self.position = self.dataStart
+		super(FileSource, self).__init__(rate, 1, realtime)
+
+	def parseWavHeader(self):
+		"""Find the format and data chunks of a WAV file. Returns the rate."""
+		# CITE: http://soundfile.sapp.org/doc/WaveFormat/
+		offset, rate = 12, None
+		while ( offset + 8 <= len(self.map) ):
+			chunkId = self.map[offset:offset+4]
+			chunkSize = struct.unpack("<I", self.map[offset+4:offset+8])[0]
+			body = offset + 8
+			if ( chunkId == "fmt " ):
+				(audioFormat, self.fileChannels, rate, byteRate, blockAlign,
+				 bits) = struct.unpack("<HHIIHH", self.map[body:body+16])
+				self.sampleWidth = bits / 8
+			elif ( chunkId == "data" ):
+				self.dataStart = body
+				self.dataEnd = min(body + chunkSize, len(self.map))
+				break
+			offset = body + chunkSize + (chunkSize % 2) # chunks are padded
+		if ( rate is None ):
+			raise IOError("%s has no fmt chunk." % self.path)
+		return rate
+
+	def seek(self, frame):
+		"""Carry on reading from frame (counted from the start of the
+		audio); the audio clock jumps there too."""
+		frame = max(0, min(frame, self.frameCount))
+		self.position = self.dataStart + frame * self.frameWidth
+		self.framesRead = frame
+
+	def readFrames(self, frames):
+		wanted = frames * self.frameWidth
+		block = self.map[self.position:min(self.position+wanted, self.dataEnd)]
+		self.position += len(block)
+		while ( self.loop and len(block) < wanted 
+				and self.dataEnd > self.dataStart ):
+			self.position = self.dataStart
+			more = self.map[self.position:
+							min(self.position+wanted-len(block), self.dataEnd)]
+			self.position += len(more)
+			block += more
+		if ( len(block) == 0 ):
+			raise EOFError("End of %s" % self.path)
+		return self.toMono16(block)
+
+	def toMono16(self, block):
+		"""Convert a block of file audio to 16-bit mono."""
+		if ( self.sampleWidth == 1 ):
+			# 8-bit WAV is unsigned (silence is 128); everything else signed
+			block = audioop.bias(block, 1, -128)
+		if ( self.sampleWidth != 2 ):
+			block = audioop.lin2lin(block, self.sampleWidth, 2)
+		if ( self.fileChannels > 1 ):
+			# Only handles stereo; anything wider gets the first two channels
+			if ( self.fileChannels > 2 ):
+				frameWidth = 2 * self.fileChannels
+				block = "".join([block[i:i+4] for i in
+								 xrange(0, len(block), frameWidth)])
+			block = audioop.tomono(block, 2, 0.5, 0.5)
+		return block
+
+	def close(self):
+		self.map.close()
+		self.file.close()
+
+	@classmethod
+	def test(_class):
+		"""Tests for the FileSource class."""
+		import wave, tempfile, os
+		rate = 8000
+		sine = np.sin(2 * np.pi * 440 * np.arange(rate) / float(rate))
+		def roundTrip(samples, sampleWidth, channels):
+			(handle, path) = tempfile.mkstemp(suffix=".wav")
+			os.close(handle)
+			wavFile = wave.open(path, "wb")
+			wavFile.setnchannels(channels)
+			wavFile.setsampwidth(sampleWidth)
+			wavFile.setframerate(rate)
+			wavFile.writeframes(samples.tostring())
+			wavFile.close()
+			source = _class(path)
+			assert( source.rate == rate and source.frameCount == len(sine) )
+			block = source.read(len(sine))
+			source.close()
+			os.remove(path)
+			return np.frombuffer(block, dtype=np.int16) / 32768.0
+
+		# 16-bit stereo comes out as the mix of the two channels
+		stereo = np.column_stack((sine, sine * 0.5)) * 16000
+		mono = roundTrip(stereo.astype("<i2"), 2, 2)
+		assert( np.abs(mono - sine * 0.75 * 16000 / 32768.0).max() < 0.001 )
+		# 8-bit is unsigned: no DC offset, and the sign stays right
+		unsigned = np.round(sine * 100 + 128).astype(np.uint8)
+		mono = roundTrip(unsigned, 1, 1)
+		assert( abs(mono.mean()) < 0.01 )
+		assert( np.abs(mono - sine * 100 / 128.0).max() < 0.01 )
+
+
+class Signal(object):
+	"""A synthetic signal. render(t) returns samples in [-1, 1] for an array
+	of sample times in seconds. Signals can be added together.
+	"""
+	def render(self, t):
+		error = "Please define your own version of this function in your subclass."
+		raise NotImplementedError(error)
+
+	def __add__(self, other):
+		return Mix([self, other])
+
+class Mix(Signal):
+	"""Several signals played at once."""
+	def __init__(self, signals):
+		self.signals = signals
+
+	def render(self, t):
+		return sum([signal.render(t) for signal in self.signals])
+
+class Sine(Signal):
+	def __init__(self, freq, amplitude=0.5):
+		self.freq = freq
+		self.amplitude = amplitude
+
+	def render(self, t):
+		return self.amplitude * np.sin(2 * np.pi * self.freq * t)
+
+class Harmonics(Signal):
+	"""A harmonic stack: the fundamental plus overtones, with one amplitude
+	per partial (e.g. [0.5, 0.25, 0.125] for a bright-ish tone)."""
+	def __init__(self, freq, amplitudes=(0.4, 0.2, 0.1, 0.05)):
+		self.freq = freq
+		self.amplitudes = amplitudes
+
+	def render(self, t):
+		return sum([amplitude * np.sin(2 * np.pi * self.freq * (i+1) * t)
+					for (i, amplitude) in enumerate(self.amplitudes)])
+
+class Noise(Signal):
+	"""White noise. Seeded, so runs are repeatable."""
+	def __init__(self, amplitude=0.05, seed=0):
+		self.amplitude = amplitude
+		self.random = np.random.RandomState(seed)
+
+	def render(self, t):
+		return self.amplitude * self.random.uniform(-1, 1, len(t))
+
+class Glide(Signal):
+	"""A linear glide (portamento) from one frequency to another, holding
+	the end frequency afterwards."""
+	def __init__(self, startFreq, endFreq, seconds, amplitude=0.5):
+		self.startFreq = startFreq
+		self.endFreq = endFreq
+		self.seconds = float(seconds)
+		self.amplitude = amplitude
+
+	def render(self, t):
+		# Integrate frequency to get a continuous phase
+		slope = (self.endFreq - self.startFreq) / self.seconds
+		gliding = np.minimum(t, self.seconds)
+		phase = self.startFreq * gliding + slope * gliding**2 / 2.0
+		phase += self.endFreq * (t - gliding)
+		return self.amplitude * np.sin(2 * np.pi * phase)
+
+
+class SyntheticSource(AudioSource):
+	"""Generates audio from a Signal instead of recording it.
+
+	Example:
+	source = SyntheticSource(Harmonics(220) + Noise(0.01), seconds=10)
+	listener = PitchDetect(source=source)
+	"""
+	def __init__(self, signal, rate=44100, seconds=None, realtime=False):
+		super(SyntheticSource, self).__init__(rate, 1, realtime)
+		self.signal = signal
+		self.frameCount = None if seconds is None else int(seconds * rate)
+
+	def readFrames(self, frames):
+		start = self.framesRead
+		if ( self.frameCount is not None ):
+			frames = min(frames, self.frameCount - start)
+			if ( frames <= 0 ):
+				raise EOFError("End of synthetic signal")
+		t = np.arange(start, start + frames) / float(self.rate)
+		samples = np.clip(self.signal.render(t), -1, 1) * 32767
+		return samples.astype(np.int16).tostring()
+
+
+class BlockQueue(object):
+	"""A bounded queue of audio blocks between a capture thread (or PyAudio
+	callback) and whatever does the processing.
+
+	When the queue is full, policy decides what happens:
+		"drop-oldest": throw away the oldest queued block to make room, so
+			capture never waits (good for live input)
+		"block": wait for the consumer to catch up, so nothing is lost 
+			(good for files and synthetic sources)
+
+	Counters: blocksIn, blocksOut, blocksDropped, and producerWaits (how
+	many times the producer had to wait under the "block" policy).
+	"""
+	policies = ("drop-oldest", "block")
+
+	def __init__(self, maxBlocks=64, policy="drop-oldest"):
+		if ( policy not in self.policies ):
+			raise ValueError("Unknown back-pressure policy: %r" % policy)
+		self.maxBlocks = maxBlocks
+		self.policy = policy
+		self.blocks = deque()
+		self.condition = threading.Condition()
+		self.closed = False
+		self.blocksIn = self.blocksOut = 0
+		self.blocksDropped = self.producerWaits = 0
+
+	def __len__(self):
+		return len(self.blocks)
+
+	def put(self, block, timeout=None):
+		"""Add a block. Returns False if a block had to be dropped."""
+		with self.condition:
+			self.blocksIn += 1
+			lossless = True
+			if ( len(self.blocks) >= self.maxBlocks ):
+				if ( self.policy == "block" ):
+					self.producerWaits += 1
+					deadline = None if timeout is None else time.time() + timeout
+					while ( len(self.blocks) >= self.maxBlocks 
+							and not self.closed ):
+						remaining = None if deadline is None else deadline - time.time()
+						if ( remaining is not None and remaining <= 0 ): break
+						self.condition.wait(remaining)
+				if ( len(self.blocks) >= self.maxBlocks ):
+					self.blocks.popleft()
+					self.blocksDropped += 1
+					lossless = False
+			self.blocks.append(block)
+			self.condition.notify_all()
+			return lossless
+
+	def get(self, timeout=None):
+		"""Take the oldest block. Returns None on timeout, and raises
+		EOFError once the queue is closed and empty."""
+		with self.condition:
+			deadline = None if timeout is None else time.time() + timeout
+			while ( not self.blocks ):
+				if ( self.closed ):
+					raise EOFError("Capture has stopped.")
+				remaining = None if deadline is None else deadline - time.time()
+				if ( remaining is not None and remaining <= 0 ): return None
+				# Wake up now and then so Ctrl-C still works (Python 2)
+				self.condition.wait(0.1 if remaining is None else remaining)
+			self.blocksOut += 1
+			block = self.blocks.popleft()
+			self.condition.notify_all()
+			return block
+
+	def clear(self):
+		"""Throw away everything queued (counted as dropped)."""
+		with self.condition:
+			self.blocksDropped += len(self.blocks)
+			self.blocks.clear()
+			self.condition.notify_all()
+
+	def close(self):
+		"""No more blocks are coming; wakes up anyone waiting."""
+		with self.condition:
+			self.closed = True
+			self.condition.notify_all()
+
+
+class QueuedSource(AudioSource):
+	"""Decouples capture from processing. Another source is read on its own
+	capture thread (or, for PyAudio, from the audio callback) into a
+	BlockQueue, and read() hands those blocks to the consumer, re-cut to 
+	whatever size it asks for. Slow processing then shows up as queued or
+	dropped blocks instead of a stalled or overflowing input stream.
+
+	Example:
+	source = QueuedSource(PyAudioSource(channels=1), policy="drop-oldest")
+	listener = PitchDetect(source=source)
+	print source.queue.blocksDropped
+	"""
+	def __init__(self, source, maxBlocks=64, policy="drop-oldest", 
+				 blockFrames=1024):
+		super(QueuedSource, self).__init__(source.rate, source.channels)
+		self.source = source
+		self.audio = getattr(source, "audio", None)
+		self.blockFrames = blockFrames
+		self.queue = BlockQueue(maxBlocks, policy)
+		self.pending = "" # leftover bytes from the last block
+		self.dropsCounted = 0
+		self.running = True
+		if ( isinstance(source, PyAudioSource) ):
+			source.startCallback(self.queue.put, blockFrames)
+			self.thread = None
+		else:
+			self.thread = threading.Thread(target=self.capture)
+			self.thread.daemon = True
+			self.thread.start()
+
+	def capture(self):
+		"""Capture thread main loop for non-PyAudio sources."""
+		while ( self.running ):
+			try:
+				block = self.source.read(self.blockFrames)
+			except EOFError:
+				break
+			self.queue.put(block)
+		self.queue.close()
+
+	def read(self, frames):
+		"""Like AudioSource.read(), but blocks the queue dropped still count
+		towards the audio clock, so timestamps stay true to the input."""
+		block = super(QueuedSource, self).read(frames)
+		dropped = self.queue.blocksDropped - self.dropsCounted
+		self.dropsCounted += dropped
+		self.framesRead += dropped * self.blockFrames
+		return block
+
+	def readFrames(self, frames):
+		wanted = frames * 2 * self.channels
+		chunks, have = [self.pending], len(self.pending)
+		while ( have < wanted ):
+			try:
+				block = self.queue.get()
+			except EOFError:
+				if ( have == 0 ): raise
+				break
+			chunks.append(block)
+			have += len(block)
+		data = "".join(chunks)
+		self.pending = data[wanted:]
+		return data[:wanted]
+
+	def close(self):
+		self.running = False
+		self.queue.close() # wakes the capture thread if it's waiting to put
+		# The source can only be closed once nothing is reading from it
+		if ( self.thread is not None ):
+			self.thread.join()
+		self.source.close()
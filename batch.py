@@ -0,0 +1,283 @@
+from offline import *
+import exporter
+import multiprocessing, os, glob
+
+def detectChunk(job):
+	"""Worker process: run pitch and onset detection over one chunk of a
+	file (ticks firstTick up to lastTick). Returns the job with the ticks'
+	start times, MIDI numbers and onsets."""
+	(path, options, firstTick, lastTick) = job
+	transcription = OfflineTranscription(path, **options)
+	# Only a file's first chunk warns about frames too short for low notes
+	transcription.listener.rangeChecked = firstTick > 0
+	transcription.seek(firstTick)
+	times, ticks, onsets = [], [], []
+	for (batchTimes, batchTicks, batchOnsets) in transcription.readAll():
+		times.append(batchTimes)
+		ticks.append(batchTicks)
+		onsets.append(batchOnsets)
+		if ( transcription.ticks >= lastTick ):
+			break
+	transcription.source.close()
+	count = lastTick - firstTick
+	return (job, np.concatenate(times or [[]])[:count],
+			np.concatenate(ticks or [[]]).astype(np.int16)[:count],
+			np.concatenate(onsets or [[]]).astype(bool)[:count])
+
+class BatchTranscription(object):
+	"""Transcribes a pile of WAV files on a process pool.
+
+	Long files are cut into chunks of about chunkSeconds, each detected
+	in its own worker, with overlapSeconds of extra audio on both sides
+	so the onset detector and noise gate have settled by the time the
+	chunk proper starts. The chunks' pitch tracks are then stitched back
+	together, cutting each overlap at a note boundary both chunks agree
+	on, and the whole track goes through the Quantizer and MeasureBuilder
+	in one piece, just like OfflineTranscription.run().
+
+	Chunks always start on a measure, and where they fall depends only
+	on the file and the settings, so the output is the same however many
+	workers there are. (One difference from a single run: the "Smooth
+	Input Audio" switch to longer windows is left out, since it would
+	move the tick grid mid-file.)
+
+	Example:
+	from batch import *
+	batch = BatchTranscription(glob.glob("rehearsals/*.wav"), "scores",
+							   processes=4, tempo=90)
+	batch.run()
+	print batch.audioSeconds / batch.wallSeconds
+	"""
+	def __init__(self, paths, outputDirectory=".", processes=None,
+				 chunkSeconds=30.0, overlapSeconds=2.0, formats=("musicxml",),
+				 **options):
+		self.paths = list(paths)
+		self.names = self.outputNames(self.paths)
+		self.outputDirectory = outputDirectory
+		self.processes = processes or multiprocessing.cpu_count()
+		self.chunkSeconds = chunkSeconds
+		self.overlapSeconds = overlapSeconds
+		self.formats = formats
+		self.options = options # for OfflineTranscription
+		self.options["batch"] = True
+		self.audioSeconds = 0.0
+		self.wallSeconds = 0.0
+		self.written = [] # output paths
+
+	@classmethod
+	def outputNames(_class, paths):
+		"""What to call each file's output (less its extension): the
+		input's name, unless two inputs share one (day1/take1.wav and
+		day2/take1.wav), in which case they get their directory's name in
+		front (day1-take1, day2-take1), and a number after if that's still
+		not enough."""
+		stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+		names = []
+		for (path, stem) in zip(paths, stems):
+			if ( stems.count(stem) > 1 ):
+				parent = os.path.basename(os.path.dirname(os.path.abspath(path)))
+				stem = parent + "-" + stem
+			name, number = stem, 2
+			while ( name in names ):
+				name = "%s-%d" % (stem, number)
+				number += 1
+			names.append(name)
+		return names
+
+	def plan(self, path):
+		"""Cut a file into chunk jobs: (path, options, firstTick, lastTick),
+		plus where each chunk proper starts. Returns (jobs, starts)."""
+		transcription = OfflineTranscription(path, **self.options)
+		measureTicks = transcription.measureTicks
+		measureSeconds = transcription.builder.measureSeconds
+		tickFrames = transcription.builder.tickSeconds * transcription.rate
+		totalTicks = int(np.ceil(transcription.source.frameCount / tickFrames))
+		transcription.source.close()
+
+		chunkTicks = measureTicks * max(1,
+							int(round(self.chunkSeconds / measureSeconds)))
+		overlapTicks = measureTicks * int(np.ceil(self.overlapSeconds /
+												  measureSeconds))
+		jobs, starts = [], []
+		for start in xrange(0, max(totalTicks, 1), chunkTicks):
+			firstTick = max(0, start - overlapTicks)
+			lastTick = min(totalTicks, start + chunkTicks + overlapTicks)
+			jobs.append((path, self.options, firstTick, lastTick))
+			starts.append(start)
+		return (jobs, starts)
+
+	@classmethod
+	def stitch(_class, chunks, starts):
+		"""Join chunks' (job, times, ticks, onsets) into one track. Each
+		overlap is cut at the note boundary nearest the next chunk's start
+		that both chunks agree on (or right at its start if there isn't
+		one), so notes aren't chopped up by the chunking."""
+		pieces = []
+		cut = 0 # global tick the current chunk is used from
+		for (i, (job, times, ticks, onsets)) in enumerate(chunks):
+			firstTick = job[2]
+			end = firstTick + len(ticks)
+			if ( i + 1 < len(chunks) ):
+				nextChunk = chunks[i + 1]
+				end = _class.findCut(ticks, firstTick, nextChunk[2],
+									 nextChunk[0][2], starts[i + 1], end)
+			local = slice(cut - firstTick, max(cut, end) - firstTick)
+			pieces.append((times[local], ticks[local], onsets[local]))
+			cut = max(cut, end)
+		return [np.concatenate([piece[field] for piece in pieces])
+				for field in xrange(3)]
+
+	@classmethod
+	def findCut(_class, ticks, firstTick, nextTicks, nextFirst, start, end):
+		"""Where to switch from one chunk's ticks to the next's: the note
+		boundary (a change in ticks both chunks agree on) nearest start,
+		within the middle half of the overlap."""
+		# (The next chunk may have come back short, at the end of a file)
+		overlapStart = nextFirst
+		overlapEnd = min(end, nextFirst + len(nextTicks))
+		reach = (overlapEnd - overlapStart) / 4
+		best = None
+		for tick in xrange(max(overlapStart + 1, start - reach),
+						   min(overlapEnd, start + reach)):
+			here = tick - firstTick
+			there = tick - nextFirst
+			if ( ticks[here] != ticks[here - 1] and
+				 ticks[here] == nextTicks[there] and
+				 ticks[here - 1] == nextTicks[there - 1] ):
+				if ( best is None or abs(tick - start) < abs(best - start) ):
+					best = tick
+		return start if best is None else best
+
+	@classmethod
+	def test(_class):
+		"""Tests for BatchTranscription's chunk stitching."""
+		track = np.array([60]*24 + [62]*3 + [64]*33, dtype=np.int16)
+		# Chunk A has ticks 0-29, B has 20-39: the overlap is 20-29, and
+		# cuts are looked for within 2 ticks of where B proper starts
+		A, B = track[:30], track[20:40]
+		assert( _class.findCut(A, 0, B, 20, 25, 30) == 24 )
+		assert( _class.findCut(A, 0, B, 20, 26, 30) == 27 ) # the nearer one
+		assert( _class.findCut(A, 0, B, 20, 29, 30) == 27 )
+		# A boundary right at the edge of the search doesn't count
+		assert( _class.findCut(A, 0, B, 20, 22, 30) == 22 )
+		# Nor does one the chunks disagree on (B's detector still settling)
+		settling = B.copy()
+		settling[:5] = 60
+		settling[5:7] = 62
+		assert( _class.findCut(A, 0, settling, 20, 25, 30) == 25 )
+		# A next chunk that came back short
+		assert( _class.findCut(A, 0, B[:5], 20, 25, 30) == 24 )
+		assert( _class.findCut(A, 0, B[:3], 20, 25, 30) == 25 )
+
+		# Three chunks with garbage where the detectors hadn't settled
+		# (the edges of each overlap) stitch back into the whole track
+		starts = [0, 20, 40]
+		chunks = []
+		for (firstTick, lastTick) in [(0, 24), (16, 44), (36, 60)]:
+			ticks = track[firstTick:lastTick].copy()
+			if ( firstTick > 0 ):
+				ticks[:2] = 70
+			if ( lastTick < len(track) ):
+				ticks[-2:] = 70
+			times = np.arange(firstTick, lastTick) * 0.1
+			onsets = np.zeros(len(ticks), dtype=bool)
+			chunks.append((("", {}, firstTick, lastTick), times, ticks, onsets))
+		(times, ticks, onsets) = _class.stitch(chunks, starts)
+		assert( list(ticks) == list(track) )
+		assert( np.allclose(times, np.arange(len(track)) * 0.1) )
+		assert( len(onsets) == len(track) )
+
+		# Inputs with the same name don't overwrite each other's output
+		names = _class.outputNames(["day1/take1.wav", "day2/take1.wav",
+									"take2.wav", "day1-take1.wav",
+									"day2/take1.wav"])
+		assert( names == ["day1-take1", "day2-take1", "take2",
+						  "day1-take1-2", "day2-take1-2"] )
+
+	def finish(self, path, name, chunks, starts):
+		"""Build the measures for a file from its chunks and write them
+		to name (see outputNames()) in the output directory."""
+		transcription = OfflineTranscription(path, **self.options)
+		seconds = transcription.source.frameCount / float(transcription.rate)
+		transcription.source.close()
+		(times, ticks, onsets) = self.stitch(chunks, starts)
+
+		quantizer = Quantizer(transcription.builder, transcription.tracker)
+		part = transcription.transcribedPart
+		part.insert(0, tempo.MetronomeMark(number=transcription.tempo))
+		onsets = onsets if transcription.onsets else None
+		for measure in quantizer.add(times, ticks, onsets, until=seconds):
+			part.append(measure)
+		for measure in quantizer.flush(seconds):
+			part.append(measure)
+
+		basePath = os.path.join(self.outputDirectory, name)
+		extensions = dict(exporter.formats)
+		for format in self.formats:
+			self.written.append(part.write(format,
+							fp=basePath + extensions.get(format, "." + format)))
+		self.audioSeconds += seconds
+		return seconds
+
+	def run(self, report=None):
+		"""Transcribe every file. report(path, audio seconds) is called as
+		each one is written."""
+		start = time.time()
+		plans = [self.plan(path) for path in self.paths]
+		jobs = [job for (fileJobs, starts) in plans for job in fileJobs]
+		pool = multiprocessing.Pool(self.processes)
+		try:
+			# imap hands results back in order, whoever finished first
+			results = pool.imap(detectChunk, jobs)
+			for (path, name, (fileJobs, starts)) in zip(self.paths, self.names,
+														plans):
+				chunks = [results.next() for job in fileJobs]
+				seconds = self.finish(path, name, chunks, starts)
+				if ( report is not None ):
+					report(path, seconds)
+		finally:
+			pool.close()
+			pool.join()
+		self.wallSeconds = time.time() - start
+		return self.written
+
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description="Transcribe many WAV files.")
+	parser.add_argument("inputs", nargs="+",
+						help="WAV files, or directories of them")
+	parser.add_argument("--out", default=".", help="output directory")
+	parser.add_argument("--processes", type=int, help="default: one per CPU")
+	parser.add_argument("--chunk", type=float, default=30.0,
+						help="seconds of audio per worker job")
+	parser.add_argument("--overlap", type=float, default=2.0,
+						help="seconds of overlap between chunks")
+	parser.add_argument("--midi", action="store_true",
+						help="write MIDI as well as MusicXML")
+	parser.add_argument("--tempo", type=int, default=60)
+	parser.add_argument("--time", default="4/4", help="time signature")
+	parser.add_argument("--smooth", action="store_true")
+	parser.add_argument("--engine", help="pitch engine (see estimators.py)")
+	parser.add_argument("--no-onsets", dest="onsets", action="store_false")
+	args = parser.parse_args()
+
+	paths = []
+	for name in args.inputs:
+		if ( os.path.isdir(name) ):
+			paths.extend(sorted(glob.glob(os.path.join(name, "*.wav"))))
+		else:
+			paths.append(name)
+	if ( not os.path.isdir(args.out) ):
+		os.makedirs(args.out)
+	formats = ("musicxml", "midi") if args.midi else ("musicxml",)
+	batch = BatchTranscription(paths, args.out, args.processes, args.chunk,
+							   args.overlap, formats, tempo=args.tempo,
+							   smoothing=args.smooth, engine=args.engine,
+							   onsets=args.onsets, timeSignature=args.time)
+	def report(path, seconds):
+		print "%s: %0.1f sec of audio" % (path, seconds)
+	batch.run(report)
+	print "%0.1f sec of audio in %0.1f sec (%0.1f audio sec per wall sec)" % (
+		batch.audioSeconds, batch.wallSeconds,
+		batch.audioSeconds / max(batch.wallSeconds, 1e-6))
@@ -0,0 +1,259 @@
+from pitchdetect import *
+import multiprocessing
+import numpy as np
+
+class SharedRing(object):
+	"""A ring buffer of fixed-size records (a NumPy dtype) in shared
+	memory, written by one process and read by another. Nothing is
+	pickled or sent down a pipe: put() copies the record into the next
+	slot and bumps a counter, get() copies it out.
+
+	If the reader falls capacity - 1 records behind, the oldest are
+	overwritten and counted in dropped. (One slot is kept free: it's the
+	one put() may be in the middle of writing.)
+
+	Only one thread of one process may put(), and only one may get();
+	clear() can be called from any thread on the reading side.
+
+	Example:
+	ring = SharedRing([("time", "<f8"), ("freq", "<f8")], capacity=1024)
+	ring.put((0.5, 440.0)) # in one process
+	record = ring.get(timeout=1.0) # in another; None on timeout
+	"""
+	def __init__(self, dtype, capacity=1024):
+		self.dtype = np.dtype(dtype)
+		self.capacity = capacity
+		self.memory = multiprocessing.RawArray("c", capacity * self.dtype.itemsize)
+		self.written = multiprocessing.RawValue("L", 0) # records ever put
+		self.read = multiprocessing.RawValue("L", 0) # records ever taken
+		self.dropped = multiprocessing.RawValue("L", 0)
+		self.ready = multiprocessing.Event() # set after every put()
+		self.closed = multiprocessing.RawValue("b", 0)
+		self.view = None
+		self.clearedTo = 0 # set by clear(), acted on by get()
+
+	@property
+	def records(self):
+		# Each process makes its own view of the shared memory
+		if ( self.view is None ):
+			self.view = np.frombuffer(self.memory, dtype=self.dtype)
+		return self.view
+
+	def __len__(self):
+		read = max(self.read.value, self.clearedTo)
+		return min(self.written.value - read, self.capacity - 1)
+
+	def put(self, record):
+		self.records[self.written.value % self.capacity] = record
+		self.written.value += 1
+		self.ready.set()
+
+	def close(self):
+		"""No more records are coming."""
+		self.closed.value = 1
+		self.ready.set()
+
+	def get(self, timeout=None):
+		"""Take the oldest record. Returns None on timeout, and raises
+		EOFError once the ring is closed and empty."""
+		while True:
+			if ( self.read.value < self.clearedTo ):
+				self.read.value = self.clearedTo
+			if ( self.read.value >= self.written.value ):
+				if ( self.closed.value ):
+					raise EOFError("Detection has stopped.")
+				self.ready.clear()
+				if ( self.read.value < self.written.value ):
+					continue # put() got in between
+				if ( not self.ready.wait(timeout) ):
+					return None
+				continue
+			behind = self.written.value - self.read.value
+			if ( behind >= self.capacity ):
+				self.dropped.value += behind - self.capacity + 1
+				self.read.value = self.written.value - self.capacity + 1
+			position = self.read.value
+			record = self.records[position % self.capacity].copy()
+			# put() writes a slot before counting it, so if it has got a
+			# whole lap ahead, it may have been writing this one meanwhile
+			if ( self.written.value - position < self.capacity ):
+				self.read.value = position + 1
+				return record
+
+	def clear(self):
+		"""Throw away everything waiting. Only get() moves the read
+		position, so this just says how far it should skip."""
+		self.clearedTo = self.written.value
+
+	@classmethod
+	def test(_class):
+		"""Tests for the SharedRing class."""
+		ring = _class([("n", "<i4")], capacity=4)
+		assert( ring.get(timeout=0.01) is None )
+		# Overrun: the oldest are dropped and counted
+		for n in xrange(10):
+			ring.put((n,))
+		assert( len(ring) == 3 )
+		assert( [int(ring.get()["n"]) for i in xrange(3)] == [7, 8, 9] )
+		assert( ring.dropped.value == 7 and len(ring) == 0 )
+		# clear() skips what's waiting, but not what comes after
+		ring.put((10,))
+		ring.clear()
+		ring.put((11,))
+		assert( len(ring) == 1 and ring.get()["n"] == 11 )
+		# After close(), what's left still comes out, then EOFError
+		ring.put((12,))
+		ring.close()
+		assert( ring.get()["n"] == 12 )
+		try:
+			ring.get(timeout=0.01)
+			assert( False )
+		except EOFError:
+			pass
+
+		# A writer process lapping a slow reader: everything is either
+		# read, in order and intact, or counted as dropped
+		ring = _class([("n", "<i4"), ("check", "<i4")], capacity=8)
+		def write():
+			for n in xrange(20000):
+				ring.put((n, -n))
+			ring.close()
+		writer = multiprocessing.Process(target=write)
+		writer.start()
+		seen = []
+		try:
+			while True:
+				record = ring.get(timeout=5.0)
+				assert( record is not None and record["check"] == -record["n"] )
+				seen.append(int(record["n"]))
+		except EOFError:
+			pass
+		writer.join()
+		assert( seen == sorted(set(seen)) )
+		assert( len(seen) + ring.dropped.value == 20000 )
+
+
+class DetectorProcess(multiprocessing.Process):
+	"""Runs audio capture and PitchDetect in a process of its own, so
+	detection gets a core (and an interpreter lock) to itself. The
+	listener is made inside the new process by factory(**options), so
+	the sound card is only ever opened there; every smoothedPitch() it
+	makes is written to a SharedRing as a small record. If capture gets
+	ahead of it, the backlog is detected in one batch (see
+	PitchDetect.catchUp()) and written as a record per estimate.
+
+	Starts paused; see RemoteListener for the other end.
+	"""
+	record = [("time", "<f8"), ("clock", "<f8"), ("freq", "<f8"),
+			  ("onset", "?")]
+
+	def __init__(self, factory=PitchDetect, capacity=1024, **options):
+		multiprocessing.Process.__init__(self)
+		self.daemon = True
+		self.factory = factory
+		self.options = options
+		self.results = SharedRing(self.record, capacity)
+		self.running = multiprocessing.Event() # cleared while paused
+		self.stopped = multiprocessing.Event()
+		self.windowLength = multiprocessing.RawValue("i", 3)
+
+	def run(self):
+		"""Implementation of multiprocessing.Process() run function, which
+		is the detector process's main loop."""
+		listener = self.factory(**self.options)
+		try:
+			while ( not self.stopped.is_set() ):
+				if ( not self.running.wait(0.1) ):
+					continue
+				listener.windowLength = self.windowLength.value
+				try:
+					if ( getattr(listener, "backlog", 0) > 1 
+						 and listener.catchUp() > 0 ):
+						self.putBatch(listener)
+						continue
+					listener.smoothedPitch()
+				except EOFError:
+					break
+				if ( len(listener.times) == 0 ):
+					continue # nothing read
+				freq = listener.pitch.freq if listener.detectedPitch else 0.0
+				self.results.put((listener.times[-1], listener.clock, freq,
+								  listener.onset))
+		finally:
+			self.results.close()
+			listener.stop()
+
+	def putBatch(self, listener):
+		"""Write a record for each estimate catchUp() made. Each one's 
+		clock is the next one's time, so the reader never hears that audio
+		has been covered before its estimates arrive."""
+		clocks = list(listener.times[1:]) + [listener.clock]
+		for (time, clock, pitch, onset) in zip(listener.times, clocks, 
+											   listener.smoothed, 
+											   listener.onsets):
+			freq = pitch.freq if pitch is not None else 0.0
+			self.results.put((time, clock, freq, onset))
+
+
+class RemoteListener(object):
+	"""Stands in for a PitchDetect that's running in a DetectorProcess.
+	smoothedPitch() waits for the next record from the detector and sets
+	the same attributes the real one would (pitch, detectedPitch, times,
+	onset, clock), so TranscriptionPipeline can't tell the difference.
+
+	pause() and unpause() pause the detector itself; unpausing throws out
+	anything heard while paused.
+
+	Example:
+	listener = RemoteListener(channels=1)
+	listener.unpause()
+	listener.smoothedPitch()
+	print listener.pitch
+	"""
+	def __init__(self, factory=PitchDetect, capacity=1024, **options):
+		self.process = DetectorProcess(factory, capacity, **options)
+		self.results = self.process.results
+		self.pitch = None
+		self.detectedPitch = False
+		self.times = np.zeros(0)
+		self.onset = False
+		self.clock = 0.0
+		self.process.start()
+
+	@property
+	def windowLength(self):
+		return self.process.windowLength.value
+
+	@windowLength.setter
+	def windowLength(self, windowLength):
+		self.process.windowLength.value = windowLength
+
+	def smoothedPitch(self):
+		"""Wait for the detector's next estimate. Raises EOFError once the
+		detector has stopped."""
+		record = None
+		while ( record is None ):
+			record = self.results.get(timeout=1.0)
+			if ( record is None and not self.process.is_alive() ):
+				raise EOFError("The detector process has died.")
+		self.times = np.array([record["time"]])
+		self.clock = float(record["clock"])
+		self.onset = bool(record["onset"])
+		self.detectedPitch = record["freq"] > 0
+		self.pitch = Pitch(float(record["freq"])) if self.detectedPitch else None
+
+	def pause(self):
+		self.process.running.clear()
+
+	def unpause(self):
+		self.results.clear()
+		self.process.running.set()
+
+	def stop(self):
+		self.process.stopped.set()
+		self.process.running.set()
+		self.process.join(1.0)
+
+
+if __name__ == '__main__':
+	SharedRing.test()
@@ -0,0 +1,297 @@
+import numpy as np
+
+try:
+	import analyse
+except ImportError:
+	# SoundAnalyse doesn't build everywhere; the NumPy engines don't need it
+	analyse = None
+
+class PitchEstimator(object):
+	"""Base class for pitch estimation engines.
+
+	estimate(samples) takes a 1-D array of samples and returns a
+	(frequency, confidence) pair: frequency in Hz, or None if there's no
+	clear pitch, and confidence from 0 (no idea) to 1 (certain).
+
+	estimateBatch(frames) does the same for a frames x samples array in one
+	go, returning an array of frequencies (0 where there's no pitch) and an
+	array of confidences. It's one set of FFTs for all the frames, so use
+	it whenever there's more than one frame to hand.
+
+	Subclasses implement estimateBatch(); estimate() is a batch of one.
+	"""
+	def __init__(self, rate=44100, minFrequency=82.0, maxFrequency=1000.0,
+				 threshold=0.5):
+		self.rate = rate
+		self.minFrequency = minFrequency
+		self.maxFrequency = maxFrequency
+		self.threshold = threshold # least confidence worth reporting
+
+	def estimate(self, samples):
+		freqs, confidences = self.estimateBatch(np.asarray(samples)[np.newaxis])
+		if ( freqs[0] > 0 ):
+			return (freqs[0], confidences[0])
+		return (None, confidences[0])
+
+	def estimateBatch(self, frames):
+		error = "Please define your own version of this function in your subclass."
+		raise NotImplementedError(error)
+
+	def lagRange(self, count):
+		"""Shortest and longest periods (in samples) worth looking at."""
+		shortest = max(2, int(self.rate / float(self.maxFrequency)))
+		longest = min(count - 2, int(np.ceil(self.rate / float(self.minFrequency))))
+		return shortest, longest
+
+	def lowestFrequency(self, count):
+		"""The lowest pitch frames of count samples can find; below
+		minFrequency when the frames are too short to hold its period."""
+		shortest, longest = self.lagRange(count)
+		return self.rate / float(max(longest, 1))
+
+	def results(self, lags, confidences, found):
+		"""Turn (fractional) lags into frequency and confidence arrays."""
+		confidences = np.clip(confidences, 0.0, 1.0)
+		good = found & (lags > 0) & (confidences >= self.threshold)
+		freqs = np.zeros(len(lags))
+		freqs[good] = self.rate / lags[good]
+		return freqs, confidences
+
+	@classmethod
+	def prepare(_class, frames, removeMean=True):
+		"""Frames as a 2-D float array, optionally with each row's DC removed."""
+		x = np.asarray(frames, dtype=np.float64)
+		if ( removeMean ):
+			x = x - x.mean(axis=1)[:, np.newaxis]
+		return x
+
+	@classmethod
+	def firstTrue(_class, mask):
+		"""Index of the first True in each row, and whether there was one."""
+		rows = np.arange(len(mask))
+		index = np.argmax(mask, axis=1)
+		return index, mask[rows, index]
+
+	@classmethod
+	def climb(_class, values, lags, limit, downhill=False):
+		"""Move each row's lag to the top of its peak (or bottom of its
+		valley, if downhill), without going past limit."""
+		rows = np.arange(len(values))
+		lags = lags.copy()
+		sign = -1 if downhill else 1
+		while ( True ):
+			canMove = lags < limit
+			nextLags = np.minimum(lags + 1, values.shape[1] - 1)
+			canMove &= sign * values[rows, nextLags] > sign * values[rows, lags]
+			if ( not canMove.any() ): return lags
+			lags += canMove
+
+	@classmethod
+	def interpolate(_class, values, lags):
+		"""Refine the position of each row's peak/valley by fitting a
+		parabola through it and its neighbours."""
+		# CITE: https://ccrma.stanford.edu/~jos/sasp/Quadratic_Interpolation_Spectral_Peaks.html
+		rows = np.arange(len(values))
+		inside = np.clip(lags, 1, values.shape[1] - 2)
+		left = values[rows, inside-1]
+		middle = values[rows, inside]
+		right = values[rows, inside+1]
+		curve = left - 2 * middle + right
+		shift = np.zeros(len(lags))
+		usable = (curve != 0) & (inside == lags)
+		shift[usable] = 0.5 * (left - right)[usable] / curve[usable]
+		return lags + np.clip(shift, -1, 1)
+
+	@classmethod
+	def autocorrelate(_class, x):
+		"""Linear (not circular) autocorrelation of each row of x, via FFT."""
+		# CITE: https://en.wikipedia.org/wiki/Autocorrelation#Efficient_computation
+		count = x.shape[1]
+		fftSize = 1 << int(np.ceil(np.log2(2 * count)))
+		spectrum = np.fft.rfft(x, fftSize, axis=1)
+		return np.fft.irfft(spectrum * np.conj(spectrum), fftSize, 
+							axis=1)[:, :count]
+
+
+class AnalyseEstimator(PitchEstimator):
+	"""The original engine: SoundAnalyse's detect_pitch. It doesn't report
+	a confidence, so a detected pitch counts as 1 and no pitch as 0.
+	It can't batch, so estimateBatch() just loops."""
+	def __init__(self, **kwargs):
+		super(AnalyseEstimator, self).__init__(**kwargs)
+		if ( analyse is None ):
+			raise ImportError("SoundAnalyse isn't installed; try engine='yin'.")
+
+	def estimate(self, samples):
+		freq = analyse.detect_pitch(np.ascontiguousarray(samples),
+									min_frequency=self.minFrequency,
+									max_frequency=self.maxFrequency,
+									samplerate=self.rate)
+		if ( freq is None ):
+			return (None, 0.0)
+		return (freq, 1.0)
+
+	def estimateBatch(self, frames):
+		freqs = np.zeros(len(frames))
+		for (i, frame) in enumerate(frames):
+			freq, confidence = self.estimate(frame)
+			freqs[i] = freq or 0.0
+		return freqs, (freqs > 0).astype(np.float64)
+
+
+class AutocorrelationEstimator(PitchEstimator):
+	"""Picks the first peak of the normalized autocorrelation that's nearly
+	as strong as the strongest one. Cheapest of the NumPy engines, but the
+	most prone to octave errors."""
+	def __init__(self, cutoff=0.95, **kwargs):
+		super(AutocorrelationEstimator, self).__init__(**kwargs)
+		self.cutoff = cutoff
+
+	def estimateBatch(self, frames):
+		x = self.prepare(frames)
+		count = x.shape[1]
+		shortest, longest = self.lagRange(count)
+		if ( longest <= shortest ):
+			return np.zeros(len(x)), np.zeros(len(x))
+		r = self.autocorrelate(x)
+		energy = r[:, :1]
+		silent = energy[:, 0] <= 0
+		energy[silent] = 1.0
+		# Unbiased: longer lags overlap fewer samples
+		r = r / energy * count / (count - np.arange(count, dtype=np.float64))
+		search = r[:, shortest:longest+1]
+		strongest = search.max(axis=1)[:, np.newaxis]
+		lags, found = self.firstTrue(search >= self.cutoff * strongest)
+		lags = self.climb(r, lags + shortest, longest)
+		confidences = r[np.arange(len(r)), lags]
+		return self.results(self.interpolate(r, lags), confidences, 
+							found & ~silent)
+
+
+class YinEstimator(PitchEstimator):
+	"""YIN: the first dip of the cumulative mean normalized difference
+	function below threshold. Good all-rounder.
+
+	yinThreshold is YIN's own (dips must go below it); confidence is
+	1 - the depth of the dip.
+	"""
+	# CITE: de Cheveigne & Kawahara, "YIN, a fundamental frequency estimator
+	# for speech and music" (2002)
+	def __init__(self, yinThreshold=0.15, **kwargs):
+		kwargs.setdefault("threshold", 0.0)
+		super(YinEstimator, self).__init__(**kwargs)
+		self.yinThreshold = yinThreshold
+
+	def lagRange(self, count):
+		# Each lag is compared over a window as long as the longest lag
+		return super(YinEstimator, self).lagRange(count / 2)
+
+	def difference(self, x, longest):
+		"""Difference function d(lag) = sum over j < W of (x[j] - x[j+lag])^2
+		for lags 0..longest, with W = len(x) - longest, via FFT."""
+		width = x.shape[1] - longest
+		fftSize = 1 << int(np.ceil(np.log2(x.shape[1] + width)))
+		# Cross-correlation of the first W samples against everything
+		cross = np.fft.irfft(np.fft.rfft(x, fftSize, axis=1) *
+							 np.conj(np.fft.rfft(x[:, :width], fftSize, axis=1)),
+							 fftSize, axis=1)[:, :longest+1]
+		squares = np.zeros((len(x), x.shape[1] + 1))
+		np.cumsum(x * x, axis=1, out=squares[:, 1:])
+		energyStart = squares[:, width:width+1]
+		energyLag = squares[:, width:width+longest+1] - squares[:, :longest+1]
+		return energyStart + energyLag - 2 * cross
+
+	def estimateBatch(self, frames):
+		x = self.prepare(frames, removeMean=False)
+		shortest, longest = self.lagRange(x.shape[1])
+		if ( longest <= shortest ):
+			return np.zeros(len(x)), np.zeros(len(x))
+		d = self.difference(x, longest)
+		# Cumulative mean normalized difference
+		lags = np.arange(1, longest + 1)
+		runningSum = np.cumsum(d[:, 1:], axis=1)
+		normalized = np.ones(d.shape)
+		nonzero = runningSum > 0
+		normalized[:, 1:][nonzero] = ((d[:, 1:] * lags)[nonzero] 
+									  / runningSum[nonzero])
+
+		search = normalized[:, shortest:longest+1]
+		first, found = self.firstTrue(search < self.yinThreshold)
+		# Where nothing dips below the threshold, settle for the deepest dip
+		# if it's at least close
+		lowest = np.argmin(search, axis=1)
+		lags = np.where(found, first, lowest) + shortest
+		lags = self.climb(normalized, lags, longest, downhill=True)
+		depth = normalized[np.arange(len(x)), lags]
+		found |= depth < 2 * self.yinThreshold
+		# A dip still going down at the longest lag is a lower note than
+		# the frame can hold, not a pitch at that lag
+		found &= lags < longest
+		return self.results(self.interpolate(normalized, lags), 1 - depth, found)
+
+
+class McLeodEstimator(PitchEstimator):
+	"""McLeod Pitch Method: picks the first key maximum of the normalized
+	square difference function (NSDF) that's within cutoff of the highest.
+	Handles octave errors better than plain autocorrelation.
+	"""
+	# CITE: McLeod & Wyvill, "A smarter way to find pitch" (2005)
+	def __init__(self, cutoff=0.9, **kwargs):
+		super(McLeodEstimator, self).__init__(**kwargs)
+		self.cutoff = cutoff
+
+	def nsdf(self, x):
+		"""NSDF n(lag) = 2 r(lag) / m(lag), all lags, via FFT."""
+		r = self.autocorrelate(x)
+		squares = np.cumsum(x * x, axis=1)
+		total = squares[:, -1:]
+		# m(lag) = sum of x[j]^2 + x[j+lag]^2 for j < count - lag
+		head = squares[:, ::-1] # sum of x[j]^2, j < count - lag
+		tail = total - squares + x * x # j >= lag
+		m = head + tail
+		n = np.zeros(x.shape)
+		nonzero = m > 0
+		n[nonzero] = 2 * r[nonzero] / m[nonzero]
+		return n
+
+	def estimateBatch(self, frames):
+		x = self.prepare(frames)
+		shortest, longest = self.lagRange(x.shape[1])
+		if ( longest <= shortest ):
+			return np.zeros(len(x)), np.zeros(len(x))
+		n = self.nsdf(x)[:, :longest+2]
+
+		# Key maxima: peaks after the NSDF first goes negative (so not the
+		# lobe around lag 0) that are above zero.
+		lagIndex = np.arange(n.shape[1])
+		firstNegative, crosses = self.firstTrue(n < 0)
+		afterLobe = lagIndex > firstNegative[:, np.newaxis]
+		peaks = np.zeros(n.shape, dtype=bool)
+		peaks[:, 1:-1] = ((n[:, 1:-1] >= n[:, :-2]) & (n[:, 1:-1] > n[:, 2:]) 
+						  & (n[:, 1:-1] > 0))
+		peaks &= afterLobe & (lagIndex >= shortest) & (lagIndex <= longest)
+		peaks &= crosses[:, np.newaxis]
+
+		highest = np.where(peaks, n, -np.inf).max(axis=1)[:, np.newaxis]
+		lags, found = self.firstTrue(peaks & (n >= self.cutoff * highest))
+		confidences = np.where(found, n[np.arange(len(n)), lags], 0.0)
+		return self.results(self.interpolate(n, lags), confidences, found)
+
+
+engines = {
+	"analyse": AnalyseEstimator,
+	"autocorrelation": AutocorrelationEstimator,
+	"yin": YinEstimator,
+	"mcleod": McLeodEstimator,
+}
+defaultEngine = "analyse" if analyse is not None else "yin"
+
+def makeEstimator(engine=None, **kwargs):
+	"""Make a pitch estimator by name (see engines), or pass one through."""
+	if ( isinstance(engine, PitchEstimator) ):
+		return engine
+	engine = engine or defaultEngine
+	if ( engine not in engines ):
+		raise ValueError("Unknown pitch engine %r; try one of %s." %
+						 (engine, ", ".join(sorted(engines))))
+	return engines[engine](**kwargs)
@@ -0,0 +1,127 @@
+import multiprocessing
+from multiprocessing.queues import SimpleQueue
+import os, shutil, tempfile
+
+# music21 write() formats, and the file extension each gets
+formats = [("musicxml", ".xml"), ("midi", ".mid"),
+		   ("lily.pdf", ".pdf"), ("lily.png", ".png")]
+
+started = None # worker processes: where to say what they're working on
+
+def startWorker(queue):
+	"""Worker process initializer (see ScoreExporter)."""
+	global started
+	started = queue
+
+def exportFormat(snapshot, format, path, job=None):
+	"""Worker process: write the MusicXML snapshot out as format at path.
+	Returns (format, path written, error message or None); errors are
+	returned rather than raised so the caller always hears back."""
+	if ( started is not None ):
+		started.put((job, format, os.getpid()))
+	try:
+		if ( format == "musicxml" ):
+			shutil.copyfile(snapshot, path)
+			return (format, path, None)
+		from music21 import converter
+		written = converter.parse(snapshot).write(format, fp=path)
+		return (format, written or path, None)
+	except Exception, error:
+		return (format, path, "%s: %s" % (type(error).__name__, error))
+
+class ScoreExporter(object):
+	"""Exports a score to several formats at once, each in its own worker
+	process, without blocking the caller (e.g. the Tk main loop).
+
+	The worker pool is made once, when the exporter is, so make it before
+	starting any threads (or Tk, or PortAudio): forking a process that
+	has them running is asking for trouble.
+
+	The score is handed over once, as a MusicXML file; export() takes a
+	private copy of it straight away, so the original can keep changing
+	(e.g. a ScoreWriter still recording). Each worker parses the copy and
+	writes its format; lilypond PDFs and PNGs then engrave in parallel
+	with each other and with everything else.
+
+	poll() never waits: it returns the (format, path, error) results that
+	have come in since the last call, error being None on success. Each
+	worker says which format it's on as it starts, so if one dies (and
+	the pool would never hear back from it), poll() sees its process is
+	gone and reports that format as failed. Slow formats, like lilypond
+	engraving a long session, are waited for however long they take.
+
+	Example:
+	exporter = ScoreExporter()
+	exporter.export("session.xml", "song", ["musicxml", "midi", "lily.pdf"])
+	while exporter.busy:
+		for (format, path, error) in exporter.poll():
+			print format, path, error or "ok"
+	exporter.close()
+	"""
+	extensions = dict(formats)
+
+	def __init__(self, processes=None):
+		self.started = SimpleQueue() # (job, format, pid) from the workers
+		# Default: one worker per format
+		self.pool = multiprocessing.Pool(processes or len(formats),
+										 startWorker, (self.started,))
+		self.jobs = {} # job number: [snapshot copy, pending results]
+		self.jobCount = 0
+		self.workers = {} # (job, format): pid of the worker doing it
+
+	@property
+	def busy(self):
+		return len(self.jobs) > 0
+
+	def export(self, snapshot, basePath, formats):
+		"""Start writing the MusicXML file snapshot to basePath plus each
+		format's extension. Returns straight away."""
+		formats = list(formats)
+		if ( len(formats) == 0 ):
+			return
+		(handle, copyPath) = tempfile.mkstemp(suffix=".xml")
+		os.close(handle)
+		shutil.copyfile(snapshot, copyPath)
+
+		job = self.jobCount
+		self.jobCount += 1
+		pending = []
+		for format in formats:
+			path = basePath + self.extensions.get(format, "." + format)
+			result = self.pool.apply_async(exportFormat, 
+										   (copyPath, format, path, job))
+			pending.append((format, path, result))
+		self.jobs[job] = [copyPath, pending]
+
+	def poll(self):
+		"""Results finished (or lost with their worker) since the last
+		poll()."""
+		while ( not self.started.empty() ):
+			(job, format, pid) = self.started.get()
+			self.workers[(job, format)] = pid
+		# The pool replaces workers that die, so one that isn't among the
+		# live ones now is gone for good
+		alive = set([worker.pid for worker in self.pool._pool
+					 if worker.exitcode is None])
+		results = []
+		for (job, (copyPath, pending)) in self.jobs.items():
+			for (format, path, result) in list(pending):
+				pid = self.workers.get((job, format))
+				if ( result.ready() ):
+					results.append(result.get())
+				elif ( pid is not None and pid not in alive ):
+					results.append((format, path, "the export worker died"))
+				else:
+					continue
+				pending.remove((format, path, result))
+				self.workers.pop((job, format), None)
+			if ( len(pending) == 0 ):
+				# Nothing can be reading the copy any more
+				del self.jobs[job]
+				os.remove(copyPath)
+		return results
+
+	def close(self):
+		"""Shut the workers down, finished or not."""
+		self.pool.terminate()
+		self.pool.join()
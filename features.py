@@ -0,0 +1,158 @@
+import numpy as np
+from collections import deque
+
+class BlockFeatures(object):
+	"""Everything PitchDetect wants to know about one block of audio,
+	worked out in one go from a single decode of the raw bytes.
+
+	block can be raw bytes or an int16 array (e.g. a frame from a Framer).
+	samples is a zero-copy int16 view of the block; everything else is
+	computed from one float conversion of it (the spectral ones lazily):
+		rms, peak: amplitude relative to full scale (0-1)
+		amplitude: RMS on the scale NoiseGate thresholds use
+		zeroCrossingRate: fraction of neighbouring samples that change sign
+		centroid: spectral centroid in Hz (0 for silence)
+		spectrum: Hann-windowed magnitude spectrum (rfft) of the block
+
+	Example:
+	features = BlockFeatures(block, 44100)
+	print features.rms, features.centroid
+	"""
+	fullScale = 32768.0
+
+	def __init__(self, block, rate):
+		self.rate = rate
+		if ( isinstance(block, np.ndarray) ):
+			self.samples = block
+		else:
+			self.samples = np.frombuffer(block, dtype=np.int16)
+		count = len(self.samples)
+		if ( count == 0 ):
+			self.rms = self.peak = self.amplitude = 0.0
+			self.zeroCrossingRate = self._centroid = 0.0
+			self._spectrum = np.zeros(0)
+			return
+
+		normalized = self.samples / self.fullScale
+		self.rms = np.sqrt(np.dot(normalized, normalized) / count)
+		self.peak = np.abs(normalized).max()
+		# Legacy scale: samples / rate instead of samples / full scale,
+		# times 1000. See PitchDetect.getAmplitude.
+		self.amplitude = self.rms * self.fullScale / rate * 1000
+
+		signs = np.signbit(self.samples)
+		self.zeroCrossingRate = (np.count_nonzero(signs[1:] != signs[:-1])
+								 / float(max(count - 1, 1)))
+
+		self.normalized = normalized
+		self._spectrum = self._centroid = None
+
+	@property
+	def spectrum(self):
+		"""Magnitude spectrum, worked out the first time it's asked for so
+		that gated (silent) blocks never pay for an FFT."""
+		if ( self._spectrum is None ):
+			self.fftSize = self.spectrumSize(len(self.samples))
+			self._spectrum = self.spectra(self.samples[np.newaxis])[0]
+		return self._spectrum
+
+	@classmethod
+	def spectrumSize(_class, count):
+		"""FFT size for count samples: zero-padded to a power of two, since
+		odd block sizes make rfft crawl."""
+		return 1 << int(np.ceil(np.log2(max(count, 1))))
+
+	@classmethod
+	def spectra(_class, frames):
+		"""spectrum for each row of a frames x samples array, in one FFT.
+		The Hann window is there because without one a steady note leaks
+		into different bins from frame to frame (see OnsetDetector)."""
+		frames = np.asarray(frames)
+		count = frames.shape[1]
+		fftSize = _class.spectrumSize(count)
+		if ( len(frames) == 0 or count == 0 ):
+			return np.zeros((len(frames), fftSize / 2 + 1 if count else 0))
+		window = np.hanning(count) / _class.fullScale
+		return np.abs(np.fft.rfft(frames * window, fftSize, axis=1))
+
+	@property
+	def centroid(self):
+		if ( self._centroid is None ):
+			spectrum = self.spectrum
+			total = spectrum.sum()
+			if ( total > 0 ):
+				binFreqs = (np.arange(len(spectrum)) * float(self.rate) 
+							/ self.fftSize)
+				self._centroid = np.dot(binFreqs, spectrum) / total
+			else:
+				self._centroid = 0.0
+		return self._centroid
+
+	def __repr__(self):
+		return ("BlockFeatures(rms=%0.4f, peak=%0.4f, zcr=%0.3f, "
+				"centroid=%0.1f)" % (self.rms, self.peak,
+									  self.zeroCrossingRate, self.centroid))
+
+
+class NoiseGate(object):
+	"""An adaptive noise gate: decides whether a block is loud enough to be
+	worth running pitch detection on.
+
+	The noise floor is the quietest block amplitude seen over the last
+	windowBlocks blocks (about 10 seconds by default), so it follows the 
+	room between phrases without being dragged up by a held note. The gate
+	opens at ratio times the floor, but never below minThreshold (the old 
+	fixed threshold) and never above maxThreshold, so that a long stretch
+	without any rests can't end up gating the instrument itself.
+
+	Counters: blocksSeen, blocksGated (and gatedFraction).
+
+	Example:
+	gate = NoiseGate()
+	if ( gate.isOpen(features.amplitude) ): detect()
+	"""
+	def __init__(self, minThreshold=0.5, maxThreshold=3.0, ratio=3.0, 
+				 windowBlocks=430, warmupBlocks=43):
+		self.minThreshold = minThreshold
+		self.maxThreshold = maxThreshold
+		self.ratio = ratio
+		self.windowBlocks = windowBlocks
+		self.warmupBlocks = warmupBlocks
+		self.reset()
+
+	def reset(self):
+		# Sliding minimum: (block number, amplitude) pairs with increasing
+		# amplitudes, so the front is always the quietest recent block.
+		# CITE: https://people.cs.uct.ac.za/~ksmith/articles/sliding_window_minimum.html
+		# For the first warmupBlocks blocks (about a second), assume a
+		# floor right at minThreshold.
+		self.noiseFloor = self.minThreshold / self.ratio
+		self.recent = deque([(self.warmupBlocks - self.windowBlocks, 
+							  self.noiseFloor)])
+		self.blocksSeen = 0
+		self.blocksGated = 0
+
+	@property
+	def threshold(self):
+		return min(self.maxThreshold, 
+				   max(self.minThreshold, self.noiseFloor * self.ratio))
+
+	@property
+	def gatedFraction(self):
+		return self.blocksGated / float(max(self.blocksSeen, 1))
+
+	def isOpen(self, amplitude):
+		"""Check a block's amplitude against the gate, then update the
+		noise floor estimate with it."""
+		self.blocksSeen += 1
+		isOpen = amplitude >= self.threshold
+		if ( not isOpen ):
+			self.blocksGated += 1
+
+		while ( self.recent and self.recent[-1][1] >= amplitude ):
+			self.recent.pop()
+		self.recent.append((self.blocksSeen, amplitude))
+		if ( self.recent[0][0] <= self.blocksSeen - self.windowBlocks ):
+			self.recent.popleft()
+		self.noiseFloor = self.recent[0][1]
+		return isOpen
@@ -0,0 +1,423 @@
+from music21 import note, stream, clef, meter
+from pitch import Pitch
+import numpy as np
+
+REST = -1 # note buffer code for a tick with no pitch
+
+class Util(object):
+	@classmethod
+	def chunks(_class, l, n):
+		# CITE: http://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks-in-python
+	    """ Yield successive n-sized chunks from l.
+	    """
+	    for i in xrange(0, len(l), n):
+	        yield l[i:i+n]
+	@classmethod
+	def stepround(_class, n, step):
+		return int( step*round(float(n)/step) )
+
+	def test(_class):
+		assert ( list(_class.chunks(range(10), 5)) == [[0, 1, 2, 3, 4], [5, 6, 7, 8, 9]] )
+		assert ( list(_class.chunks(range(10), 10)) == [[range(10)]] )
+		assert ( list(_class.chunks([], -2) )== [] )
+
+
+class NoteBuffer(object):
+	"""A measure's worth of per-tick notes, stored compactly as MIDI note
+	numbers in an int16 array, with REST for ticks that had no pitch.
+
+	Alongside the notes is a track of which ticks heard a note onset (see
+	OnsetDetector) and, optionally, when each tick was heard on the audio
+	clock (see Quantizer). It's kept separately since it can run ahead of
+	the notes: a NoteTracker hands notes back a few ticks late, onsets 
+	aren't.
+
+	Example:
+	buffer = NoteBuffer()
+	buffer.appendPitch(listener.pitch) # a Pitch, or None
+	buffer.appendOnset(listener.onset)
+	measure = builder.processBuffer(buffer)
+	buffer.clear()
+	"""
+	def __init__(self, capacity=256):
+		self.data = np.empty(capacity, dtype=np.int16)
+		self.length = 0
+		self.onsetData = np.zeros(capacity, dtype=bool)
+		self.timeData = np.zeros(capacity) # seconds
+		self.onsetLength = 0
+
+	def __len__(self):
+		return self.length
+
+	@property
+	def values(self):
+		"""The buffered ticks (a view, not a copy)."""
+		return self.data[:self.length]
+
+	@property
+	def onsets(self):
+		"""Whether each buffered tick heard an onset (False for ticks the
+		onset track hasn't reached)."""
+		onsets = np.zeros(self.length, dtype=bool)
+		known = min(self.length, self.onsetLength)
+		onsets[:known] = self.onsetData[:known]
+		return onsets
+
+	@property
+	def times(self):
+		"""When each buffered tick was heard, in seconds (NaN for ticks the
+		onset track hasn't reached)."""
+		times = np.empty(self.length)
+		times.fill(np.nan)
+		known = min(self.length, self.onsetLength)
+		times[:known] = self.timeData[:known]
+		return times
+
+	@property
+	def heard(self):
+		"""Times of everything on the onset track, decided or not."""
+		return self.timeData[:self.onsetLength]
+
+	@property
+	def hasOnsets(self):
+		return self.onsetLength > 0
+
+	@classmethod
+	def grow(_class, data, used, needed):
+		"""data, or a copy of it with room for needed entries."""
+		if ( needed <= len(data) ):
+			return data
+		grown = np.zeros(max(needed, 2 * len(data)), dtype=data.dtype)
+		grown[:used] = data[:used]
+		return grown
+
+	def append(self, midi):
+		"""Add a tick: a MIDI note number, or REST/None."""
+		self.data = NoteBuffer.grow(self.data, self.length, self.length + 1)
+		self.data[self.length] = REST if midi is None else midi
+		self.length += 1
+
+	def extend(self, midis):
+		"""Add several ticks at once (an array of MIDI numbers/REST)."""
+		midis = np.asarray(midis, dtype=np.int16)
+		needed = self.length + len(midis)
+		self.data = NoteBuffer.grow(self.data, self.length, needed)
+		self.data[self.length:needed] = midis
+		self.length = needed
+
+	def appendPitch(self, pitch):
+		"""Add a tick from a Pitch (or None for a rest)."""
+		if ( isinstance(pitch, Pitch) ):
+			self.append(int(round(pitch.midi)))
+		else:
+			self.append(REST)
+
+	def appendOnset(self, onset, time=0.0):
+		"""Add a tick to the onset track: did it hear an onset, and when?"""
+		self.extendOnsets([onset], [time])
+
+	def extendOnsets(self, onsets, times=None):
+		onsets = np.asarray(onsets, dtype=bool)
+		needed = self.onsetLength + len(onsets)
+		self.onsetData = NoteBuffer.grow(self.onsetData, self.onsetLength,
+										 needed)
+		self.timeData = NoteBuffer.grow(self.timeData, self.onsetLength,
+										needed)
+		self.onsetData[self.onsetLength:needed] = onsets
+		self.timeData[self.onsetLength:needed] = 0.0 if times is None else times
+		self.onsetLength = needed
+
+	def take(self, count):
+		"""Remove the first count ticks (and their onsets) and return them
+		as a new NoteBuffer."""
+		taken = NoteBuffer(max(count, 1))
+		taken.extend(self.data[:count])
+		remaining = self.data[count:self.length].copy()
+		self.length = len(remaining)
+		self.data[:self.length] = remaining
+		if ( self.onsetLength > 0 ):
+			known = min(count, self.onsetLength)
+			taken.extendOnsets(self.onsetData[:known], self.timeData[:known])
+			remaining = self.onsetData[count:self.onsetLength].copy()
+			remainingTimes = self.timeData[count:self.onsetLength].copy()
+			self.onsetLength = len(remaining)
+			self.onsetData[:self.onsetLength] = remaining
+			self.timeData[:self.onsetLength] = remainingTimes
+		return taken
+
+	def clear(self):
+		self.length = 0
+		self.onsetLength = 0
+
+
+class MeasureBuilder(object):
+	"""Turns a buffer of per-tick note samples into music21 measures.
+
+	This is the part of the transcriber that doesn't care where the ticks
+	came from, so it's shared between the live (Tk) transcriber and
+	offline file transcription.
+
+	Example:
+	builder = MeasureBuilder(tempo=60, tickSeconds=0.025)
+	measure = builder.processBuffer(noteBuffer) # a measure's worth of ticks
+	"""
+	def __init__(self, tempo=60, tickSeconds=0.025, smoothing=False,
+				 segmentation="onsets", timeSignature="4/4"):
+		self.smoothing = smoothing # round notes to 8ths (see also NoteTracker)
+		# "onsets": notes start at the buffer's onsets (see segment()), if it
+		# has any; "grid": each 16th's most common tick (see majority())
+		self.segmentation = segmentation
+		self.timeSignature = timeSignature
+		beats, beatUnit = [int(n) for n in timeSignature.split("/")]
+		self.sixteenthsPerMeasure = beats * 16 / beatUnit
+		self.setTempo(tempo, tickSeconds)
+
+	def setTempo(self, tempo, tickSeconds):
+		"""Work out how long a 16th and a measure are, in seconds and in
+		ticks."""
+		self.tempo = tempo
+		self.tickSeconds = tickSeconds
+		quarterNoteSeconds = 60.0 / tempo
+		self.sixteenthSeconds = quarterNoteSeconds / 4.0
+		self.measureSeconds = self.sixteenthSeconds * self.sixteenthsPerMeasure
+		self.quarterTimerTicks = quarterNoteSeconds / tickSeconds
+		self.sixteenthTimerTicks = self.quarterTimerTicks / 4.0
+		self.measureTimerTicks = (self.sixteenthTimerTicks * 
+								  self.sixteenthsPerMeasure)
+
+	def processBuffer(self, noteBuffer):
+		"""Process the recorded note buffer and turn it into
+		a new music21.stream.Measure(). The ticks are taken to be evenly
+		spaced over the measure; see Quantizer for timestamped ones.
+		"""
+		if ( isinstance(noteBuffer, NoteBuffer) ):
+			ticks = noteBuffer.values
+			onsets = noteBuffer.onsets if noteBuffer.hasOnsets else None
+		else:
+			ticks = np.asarray(noteBuffer, dtype=np.int16)
+			onsets = None
+		# Where each tick falls, in 16ths
+		positions = np.arange(len(ticks)) / self.sixteenthTimerTicks
+		return self.buildMeasure(ticks, onsets, positions)
+
+	def buildMeasure(self, ticks, onsets, positions):
+		"""Turn a measure's ticks into a music21.stream.Measure(). positions
+		are where each tick starts, in 16ths from the start of the measure;
+		onsets (or None) which ticks heard an onset."""
+		sixteenths = self.sixteenthsPerMeasure
+		if ( len(ticks) == 0 ):
+			notes = [(REST, sixteenths)]
+		elif ( self.segmentation == "onsets" and onsets is not None ):
+			# Notes start at onsets, end where the pitch goes away
+			notes = MeasureBuilder.segment(ticks, onsets, sixteenths, positions)
+		else:
+			# Is each 16th note chunk predominantly a rest or a note?
+			labels = np.clip(np.floor(positions + 1e-9).astype(int), 
+							 0, sixteenths - 1)
+			bySixteenths = MeasureBuilder.majorityBy(ticks, labels, sixteenths)
+			notes = MeasureBuilder.runs(bySixteenths)
+
+		measure = stream.Measure()
+		# Build the new measure, one note per run of equal 16ths
+		for (midi, noteLen) in notes:
+			if ( midi != REST ):
+				# a 16th note is 1/4 a quarter note
+				if ( self.smoothing ):
+					# smooth to nearest eighth
+					noteLen = Util.stepround(noteLen, 2)
+				elem = note.Note(Pitch.midiToNote(midi))
+				elem.quarterLength = (1.0/4.0) * noteLen
+				measure.append(elem)
+			else:
+				rest = note.Rest(quarterLength=(1.0/4.0) * noteLen)
+				measure.append(rest)
+
+		# You don't want too many ledger lines...
+		octaves = [n.octave for n in measure if isinstance(n, note.Note)]
+		if ( len(octaves) > 0 and min(octaves) < 4 ):
+			measure.insert(0, clef.BassClef())
+		else:
+			measure.insert(0, clef.TrebleClef())
+
+		return measure
+
+	@classmethod
+	def majority(_class, ticks, chunkSize):
+		"""The most common value in each chunkSize-long chunk of ticks (the
+		last chunk may be shorter). Ties go to the lower value, so a rest
+		beats a note."""
+		labels = np.arange(len(ticks)) // max(1, chunkSize)
+		return _class.majorityBy(ticks, labels)
+
+	@classmethod
+	def majorityBy(_class, ticks, labels, groups=None):
+		"""The most common tick for each label 0, 1, ... groups-1 (labels 
+		must be sorted, one per tick). Ties go to the lower value, and a 
+		label with no ticks at all comes out as a rest."""
+		if ( groups is None ):
+			groups = labels[-1] + 1 if len(labels) else 0
+		if ( groups == 0 ):
+			return np.zeros(0, dtype=np.int16)
+		# Codes: REST -> 0, MIDI n -> n+1. Offset each group into its own
+		# range so one bincount counts them all.
+		width = 129
+		codes = np.clip(ticks, REST, 127).astype(np.int32) + 1
+		codes += labels * width
+		counts = np.bincount(codes, minlength=groups * width)
+		counts = counts.reshape(groups, width)
+		return (counts.argmax(axis=1) - 1).astype(np.int16)
+
+	@classmethod
+	def segment(_class, ticks, onsets, sixteenths=16, positions=None):
+		"""Cut a measure of ticks into notes at its onsets, and wherever
+		the pitch changes or goes away for at least half a 16th. Each note
+		gets its most common pitch, and its start is rounded to the nearest
+		16th. Returns (value, length in 16ths) pairs like runs(), but a
+		note that's played again is two notes, not one long one.
+
+		positions are where the ticks start, in 16ths into the measure;
+		by default they're spread evenly over it. The first tick's state
+		is taken to hold from the start of the measure."""
+		count = len(ticks)
+		if ( count == 0 ):
+			return []
+		ticks = np.asarray(ticks)
+		onsets = np.asarray(onsets, dtype=bool)
+		if ( positions is None ):
+			positions = np.arange(count) * float(sixteenths) / count
+		positions = np.array(positions, dtype=np.float64)
+		positions[0] = 0.0
+
+		starts = np.concatenate(([0], np.nonzero(np.diff(ticks))[0] + 1))
+		lengths = np.diff(np.concatenate((positions[starts], [sixteenths])))
+		# Blips too short to be notes (half a 16th) fold into the note 
+		# before them
+		keep = (lengths >= 0.5) | onsets[starts]
+		keep[0] = True
+		starts = starts[keep]
+		attacks = np.zeros(count, dtype=bool)
+		attacks[starts] = True
+		attacks |= onsets
+		attacks[0] = True
+
+		labels = np.cumsum(attacks) - 1
+		values = _class.majorityBy(ticks, labels).tolist()
+		starts = np.nonzero(attacks)[0]
+		positions = np.clip(np.round(positions[starts]).astype(int), 
+							0, sixteenths)
+		ends = np.concatenate((positions[1:], [sixteenths]))
+		struck = onsets[starts]
+
+		notes = []
+		for (value, start, end, onset) in zip(values, positions, ends, struck):
+			if ( end <= start ):
+				continue # too short to write down
+			if ( notes and notes[-1][0] == value and 
+				 (value == REST or not onset) ):
+				notes[-1][1] += end - start
+			else:
+				notes.append([value, end - start])
+		return [tuple(n) for n in notes]
+
+	@classmethod
+	def runs(_class, values):
+		"""(value, length) for each run of equal neighbouring values."""
+		if ( len(values) == 0 ):
+			return []
+		starts = np.concatenate(([0], np.nonzero(np.diff(values))[0] + 1))
+		lengths = np.diff(np.concatenate((starts, [len(values)])))
+		return zip(values[starts].tolist(), lengths.tolist())
+
+
+class Quantizer(object):
+	"""Turns a stream of timestamped pitch estimates into measures, as soon
+	as each one is complete.
+
+	Estimates come in as (time, MIDI number or REST, onset) with times in
+	seconds on the audio clock (see PitchDetect.times), so a late or
+	missed timer tick moves nothing: where a note lands in the measure
+	only depends on when it was heard. A measure is done once the clock
+	passes its end (and the tracker, if there is one, has decided all of
+	it). The tempo and time signature come from the builder.
+
+	Example:
+	quantizer = Quantizer(MeasureBuilder(tempo=90, timeSignature="3/4"))
+	for measure in quantizer.add(listener.times, midis, listener.onsets):
+		part.append(measure)
+	for measure in quantizer.flush(): part.append(measure)
+	"""
+	def __init__(self, builder, tracker=None, start=0.0):
+		self.builder = builder
+		self.tracker = tracker # an optional NoteTracker
+		self.tracking = tracker is not None # can be turned off and on
+		self.buffer = NoteBuffer()
+		self.measureStart = start # audio clock time of the next measure
+		self.clock = start # how far the audio's been heard
+		self.measureCount = 0
+
+	def add(self, times, midis, onsets=None, until=None):
+		"""Add estimates, heard at times (in order), and return a list of
+		the measures that completes. until is how far the audio's been
+		heard, if that's past the last estimate's time."""
+		times = np.atleast_1d(np.asarray(times, dtype=np.float64))
+		midis = np.atleast_1d(np.asarray(midis, dtype=np.int16))
+		if ( onsets is None ):
+			onsets = np.zeros(len(times), dtype=bool)
+		self.buffer.extendOnsets(np.atleast_1d(onsets), times)
+		if ( self.tracker is not None ):
+			if ( self.tracking ):
+				midis = self.tracker.extend(midis)
+			else:
+				self.buffer.extend(self.tracker.flush())
+		self.buffer.extend(midis)
+		if ( len(times) > 0 ):
+			self.clock = max(self.clock, times[-1])
+		if ( until is not None ):
+			self.clock = max(self.clock, until)
+		return self.measures()
+
+	def measures(self):
+		"""Every measure the clock has got to the end of."""
+		done = []
+		while ( True ):
+			end = self.measureStart + self.builder.measureSeconds
+			if ( self.clock < end ):
+				break
+			count = np.searchsorted(self.buffer.heard, end)
+			if ( len(self.buffer) < count ):
+				break # still waiting on the tracker
+			done.append(self.emit(count, end))
+		return done
+
+	def flush(self, until=None):
+		"""At the end of a recording: decide everything left and return the
+		remaining measures, the last one padded out with rests."""
+		if ( self.tracker is not None ):
+			self.buffer.extend(self.tracker.flush())
+		if ( until is not None ):
+			self.clock = max(self.clock, until)
+		if ( len(self.buffer) == 0 ):
+			return []
+		# The recording stops here, so whatever's playing stops too
+		self.buffer.extendOnsets([False], [self.clock])
+		self.buffer.append(REST)
+		done = self.measures()
+		if ( len(self.buffer.heard) > 0 and self.buffer.heard[0] < self.clock ):
+			end = self.measureStart + self.builder.measureSeconds
+			done.append(self.emit(len(self.buffer), end))
+		self.buffer.clear()
+		return done
+
+	def emit(self, count, end):
+		"""Build the measure from the first count estimates."""
+		ticks = self.buffer.take(count)
+		positions = ((ticks.times - self.measureStart) / 
+					 self.builder.sixteenthSeconds)
+		measure = self.builder.buildMeasure(ticks.values, ticks.onsets,
+											positions)
+		self.measureCount += 1
+		measure.number = self.measureCount
+		if ( self.measureCount == 1 ):
+			measure.insert(0, meter.TimeSignature(self.builder.timeSignature))
+		self.measureStart = end
+		return measure
@@ -1,14 +1,40 @@
 # CITE http://people.csail.mit.edu/hubert/pyaudio/
-import pyaudio, time
+import time
+from audiosource import *
 
 class Microphone(object):
-	"""Sets up an instance of a microphone recording stream using PyAudio."""
-	def __init__(self, format=None, channels=None, rate=None):
-		self.format = format or pyaudio.paInt16 # records in WAV format; 16-bit integers
-		self.channels = channels or 2 # channels (i.e. stereo, mono, more if available)
-		self.rate = rate or 44100 # audio sampling rate
-		self.audio = pyaudio.PyAudio() # new pyAudio root instance
-		self.micStream = self.newMicStream() # new pyAudio stream instance
+	"""Sets up an instance of a microphone recording stream.
+	
+	Audio comes from an AudioSource (see audiosource.py). By default that's 
+	the sound card through PyAudio, but a FileSource or SyntheticSource 
+	can be passed in instead so nothing needs audio hardware.
+	
+	With queueSize set, capture runs on its own (PyAudio callback or 
+	capture thread) into a bounded queue, and listen() consumes from it; 
+	see QueuedSource. policy is "drop-oldest" or "block". If that can't be
+	set up (e.g. this PyAudio has no callback mode), listen() reads the 
+	source inline instead. Audio captured while paused is thrown away.
+	
+	Example:
+	listener = PitchDetect(source=SyntheticSource(Sine(440), seconds=5))
+	listener = PitchDetect(channels=1, queueSize=8, policy="drop-oldest")
+	"""
+	def __init__(self, format=None, channels=None, rate=None, source=None,
+				 queueSize=None, policy="drop-oldest"):
+		self.format = format or paInt16 # records in WAV format; 16-bit integers
+		if ( source is None ):
+			channels = channels or 2 # channels (i.e. stereo, mono, more if available)
+			rate = rate or 44100 # audio sampling rate
+			source = PyAudioSource(rate, channels, self.format)
+		if ( queueSize is not None ):
+			try:
+				source = QueuedSource(source, queueSize, policy)
+			except (IOError, TypeError):
+				pass # no callback stream (TypeError: PyAudio too old for one)
+		self.source = source
+		self.channels = channels or source.channels
+		self.rate = rate or source.rate
+		self.audio = getattr(source, "audio", None) # pyAudio root instance, if any
 		self.framesPerBuffer = 2**10 # number of samples per block (1024)
 		self.isRunning = True
 		self.timer = 0
@@ -29,7 +55,7 @@ class Microphone(object):
 	
 	def stop(self):
 		"""Stop a mic stream."""
-		self.micStream.close()
+		self.source.close()
 		self.isRunning = False
 
 	def pause(self):
@@ -41,25 +67,20 @@ class Microphone(object):
 		"""Unpause recording from a mic stream."""
 		if ( not self.isRunning ):
 			self.isRunning = True
+			# Don't pick up where capture left off before the pause
+			queue = getattr(self.source, "queue", None)
+			if ( queue is not None ):
+				queue.clear()
 
-	def newMicStream(self):
-		"""Creates a new instance of the microphone data strem."""
-		stream = self.audio.open( format = self.format,
-								  channels = self.channels,
-								  rate = self.rate,
-								  input = True
-								)
-		return stream
-					
 	def readAudio(self):
-		"""A wrapper for reading raw audio data from the microphone data stream.
+		"""A wrapper for reading raw audio data from the audio source.
 		Reads in blocks of length self.framesPerBuffer.
 		"""
 		try:
-			audioBlock = self.micStream.read(self.framesPerBuffer)
+			audioBlock = self.source.read(self.framesPerBuffer)
 			return audioBlock	
 		except IOError:
-			if ( self.debug ): self.debug(self.micStream)
+			if ( self.debug ): self.debug(self.source)
 			return False
 			
 	def listen(self):
@@ -0,0 +1,128 @@
+import struct
+from StringIO import StringIO
+
+class MidiEventWriter(object):
+	"""Writes notes to a Standard MIDI File (format 0, one track) as they
+	happen, without building a score first. Feed it pitch estimates in
+	time order with update(), or drive noteOn()/noteOff() yourself; times
+	are in seconds (e.g. PitchDetect.times) and become delta times at the
+	given tempo.
+
+	Each event costs the same however long the file gets: it's written
+	where the end-of-track marker was, followed by a new one, and the
+	track length in the header is patched, and the file is flushed. So
+	the file on disk is a valid MIDI file after every event, and can be
+	played while it's still growing.
+
+	fp is a path or a seekable file object; without one, the file is
+	built in memory and getvalue() returns it.
+
+	Example:
+	writer = MidiEventWriter("live.mid", bpm=90)
+	for (seconds, midi) in estimates:
+		writer.update(seconds, midi) # midi < 0 (or None) is a rest
+	writer.close()
+	"""
+	endOfTrack = "\x00\xff\x2f\x00"
+
+	def __init__(self, fp=None, bpm=120, division=480, velocity=80, channel=0):
+		if ( fp is None ):
+			fp = StringIO()
+		elif ( isinstance(fp, basestring) ):
+			fp = open(fp, "w+b")
+		self.file = fp
+		self.bpm = bpm
+		self.division = division # ticks per quarter note
+		self.velocity = velocity
+		self.channel = channel
+		self.lastTick = 0
+		self.note = None # MIDI number sounding now, if any
+		self.attack = None # when the last onset was heard, until it's used
+		self.eventCount = 0
+
+		self.file.write("MThd" + struct.pack(">IHHH", 6, 0, 1, division))
+		self.file.write("MTrk")
+		self.lengthAt = self.file.tell()
+		self.file.write(struct.pack(">I", 0))
+		self.trackStart = self.trackEnd = self.file.tell()
+		microseconds = int(round(60e6 / bpm))
+		self.event(0.0, "\xff\x51\x03" + struct.pack(">I", microseconds)[1:])
+
+	def ticks(self, seconds):
+		return int(round(seconds * self.bpm / 60.0 * self.division))
+
+	@classmethod
+	def variableLength(_class, value):
+		"""A MIDI variable-length quantity: 7 bits a byte, high bit set on
+		all but the last."""
+		data = chr(value & 0x7f)
+		value >>= 7
+		while ( value ):
+			data = chr(0x80 | (value & 0x7f)) + data
+			value >>= 7
+		return data
+
+	def event(self, seconds, data):
+		"""Write one event (status byte onwards) at seconds."""
+		tick = max(self.lastTick, self.ticks(seconds))
+		event = self.variableLength(tick - self.lastTick) + data
+		self.lastTick = tick
+		self.file.seek(self.trackEnd)
+		self.file.write(event + self.endOfTrack)
+		self.trackEnd += len(event)
+		self.file.seek(self.lengthAt)
+		length = self.trackEnd - self.trackStart + len(self.endOfTrack)
+		self.file.write(struct.pack(">I", length))
+		self.file.seek(0, 2)
+		self.file.flush()
+		self.eventCount += 1
+
+	def noteOn(self, midi, seconds):
+		if ( self.note is not None ):
+			self.noteOff(seconds)
+		self.note = int(midi)
+		self.event(seconds, chr(0x90 | self.channel) + chr(self.note) +
+							chr(self.velocity))
+
+	def noteOff(self, seconds):
+		if ( self.note is None ):
+			return
+		self.event(seconds, chr(0x80 | self.channel) + chr(self.note) +
+							chr(0))
+		self.note = None
+
+	def update(self, seconds, midi, onset=False):
+		"""One pitch estimate: writes events only when the note changes,
+		or after an onset (a new attack, maybe on the same note).
+
+		An onset is usually heard a block before the pitch estimate moves
+		to the new note, so it's held until the next estimate: the note
+		heard then starts at the onset, whether it's a new one or the same
+		one again."""
+		attack, self.attack = self.attack, None
+		if ( midi is None or midi < 0 ):
+			self.noteOff(seconds)
+		elif ( midi != self.note ):
+			self.noteOn(midi, seconds if attack is None else attack)
+			if ( attack is None ):
+				onset = False # that onset was this note starting
+		elif ( attack is not None ):
+			self.noteOn(midi, attack)
+		if ( onset ):
+			self.attack = seconds
+
+	def flush(self):
+		self.file.flush()
+
+	def getvalue(self):
+		"""The file so far, for in-memory writers."""
+		return self.file.getvalue()
+
+	def close(self, seconds=None):
+		"""End the last note (at seconds, or straight away) and close the
+		file. In-memory writers stay readable."""
+		if ( self.note is not None ):
+			self.noteOff(self.lastTick * 60.0 / self.bpm / self.division
+						 if seconds is None else seconds)
+		if ( not isinstance(self.file, StringIO) ):
+			self.file.close()
@@ -0,0 +1,129 @@
+from measurebuilder import REST
+from collections import deque
+import numpy as np
+
+class NoteTracker(object):
+	"""Cleans up a track of per-tick MIDI notes (REST for no pitch) before
+	it's cut into measures, by finding the most likely sequence of notes
+	actually played: a hidden Markov model over the 128 MIDI notes plus a
+	rest, decoded with the Viterbi algorithm.
+
+	Each tick, staying on the same note is free and changing note costs
+	changePenalty. Hearing something other than the note being played
+	costs mismatchPenalty, except that hearing it an octave or two off
+	costs only octavePenalty (the detector's favourite mistake) and
+	hearing nothing costs dropoutPenalty. So one-tick blips and short
+	octave jumps get absorbed into the note around them, while a real
+	change of note wins after a tick or two.
+
+	Decoding is incremental with a fixed lag: each tick pushed in decides
+	the tick from lag ticks ago, using everything heard since, so the
+	delay is bounded (lag ticks) no matter how long the recording is.
+
+	Example:
+	tracker = NoteTracker(lag=8)
+	for midi in ticks:
+		noteBuffer.extend(tracker.push(midi))
+	noteBuffer.extend(tracker.flush()) # at the end
+	"""
+	# CITE: https://en.wikipedia.org/wiki/Viterbi_algorithm
+	notes = 128
+	restState = 128 # state index of the rest
+
+	def __init__(self, lag=8, changePenalty=4.0, octavePenalty=1.5,
+				 dropoutPenalty=2.0, mismatchPenalty=5.0):
+		self.lag = lag
+		self.changePenalty = changePenalty
+		self.emissions = NoteTracker.emissionCosts(octavePenalty,
+										dropoutPenalty, mismatchPenalty)
+		self.states = np.arange(self.notes + 1)
+		self.reset()
+
+	def reset(self):
+		self.cost = None # best path cost ending in each state
+		self.pointers = deque() # each undecided tick's best previous states
+
+	@classmethod
+	def emissionCosts(_class, octavePenalty, dropoutPenalty, mismatchPenalty):
+		"""Cost of hearing each observation (row: REST, then MIDI 0-127)
+		while each state (column: MIDI 0-127, then rest) is played."""
+		heard = np.arange(-1, _class.notes)[:, np.newaxis]
+		played = np.arange(_class.notes + 1)[np.newaxis, :]
+		costs = np.empty((_class.notes + 1, _class.notes + 1))
+		costs.fill(mismatchPenalty)
+		interval = np.abs(heard - played)
+		octaves = (interval % 12 == 0) & (interval > 0) & (interval <= 24)
+		costs[octaves] = octavePenalty
+		costs[interval == 0] = 0.0
+		costs[0, :_class.notes] = dropoutPenalty # heard nothing
+		costs[0, _class.restState] = 0.0
+		costs[1:, _class.restState] = mismatchPenalty # heard a note in a rest
+		return costs
+
+	def push(self, midi):
+		"""Add a tick; returns an array of the ticks decided by it (one
+		once the tracker has lag ticks of lookahead, none before that)."""
+		observation = int(np.clip(REST if midi is None else midi, REST, 127))
+		emission = self.emissions[observation + 1]
+		if ( self.cost is None ):
+			pointers = self.states
+			cost = emission.copy()
+		else:
+			best = self.cost.argmin()
+			change = self.cost[best] + self.changePenalty
+			stay = self.cost <= change
+			pointers = np.where(stay, self.states, best)
+			cost = np.where(stay, self.cost, change) + emission
+		self.cost = cost - cost.min() # keep the numbers small
+		self.pointers.append(pointers)
+
+		if ( len(self.pointers) <= self.lag ):
+			return np.zeros(0, dtype=np.int16)
+		state = self.cost.argmin()
+		for pointers in list(self.pointers)[:0:-1]:
+			state = pointers[state]
+		self.pointers.popleft()
+		return self.toMidi(np.array([state]))
+
+	def extend(self, midis):
+		"""push() for an array of ticks; returns all the decided ticks."""
+		decided = [self.push(midi) for midi in midis]
+		if ( len(decided) == 0 ):
+			return np.zeros(0, dtype=np.int16)
+		return np.concatenate(decided)
+
+	def flush(self):
+		"""Decide all the ticks still waiting on lookahead (e.g. at the end
+		of a recording) and start afresh."""
+		if ( len(self.pointers) == 0 ):
+			self.reset()
+			return np.zeros(0, dtype=np.int16)
+		state = self.cost.argmin()
+		path = [state]
+		for pointers in list(self.pointers)[:0:-1]:
+			state = pointers[state]
+			path.append(state)
+		self.reset()
+		return self.toMidi(np.array(path[::-1]))
+
+	@classmethod
+	def toMidi(_class, states):
+		return np.where(states == _class.restState, REST,
+						states).astype(np.int16)
+
+	@classmethod
+	def test(_class):
+		"""Tests for the NoteTracker class."""
+		R = REST
+		track = [69]*10 + [81, 81] + [69]*10 + [R] + [69]*5 + [R]*10 + [71]*10
+		for lag in (0, 4, 100):
+			tracker = _class(lag=lag)
+			decided = np.concatenate((tracker.extend(track), tracker.flush()))
+			assert( len(decided) == len(track) )
+			if ( lag >= 4 ):
+				# octave jump and dropout absorbed, real changes kept
+				assert( list(decided) == [69]*28 + [R]*10 + [71]*10 )
+		assert( len(_class().flush()) == 0 )
+
+if __name__ == '__main__':
+	NoteTracker.test()
@@ -0,0 +1,240 @@
+from pitchdetect import *
+from pitcharray import PitchArray
+from measurebuilder import *
+from notetracking import *
+from audiosource import *
+from midiwriter import *
+from music21 import note, stream, tempo
+from collections import deque
+import numpy as np
+import time
+
+class OfflineTranscription(object):
+	"""Transcribes a WAV file to sheet music without Tk, lilypond or a
+	microphone. Runs the same PitchDetect -> Quantizer -> MeasureBuilder
+	pipeline as the live transcriber, but ticks are paced by the audio in
+	the file rather than by a Timer, so it runs as fast as the CPU allows.
+
+	Example:
+	from offline import *
+	transcription = OfflineTranscription("rehearsal.wav", tempo=90)
+	transcription.run()
+	transcription.write("rehearsal.xml")
+	transcription.write("rehearsal.mid", "midi")
+
+	streamMidi() is the quick way to get just a MIDI file: notes go 
+	straight from the pitch track into a MidiEventWriter, with no 
+	measures or music21 objects in between.
+	"""
+	def __init__(self, path, tempo=60, smoothing=False, batch=True, 
+				 engine=None, onsets=True, timeSignature="4/4"):
+		self.path = path
+		self.tempo = tempo
+		self.batch = batch # detect a measure at a time, see readMeasure()
+		self.source = FileSource(path)
+		self.rate = self.source.rate
+		self.listener = PitchDetect(source=self.source, engine=engine)
+		self.onsets = onsets
+		if ( onsets ):
+			# Notes get their pitch from all the estimates between onsets,
+			# so there's no need to average a tick's worth; a tick per
+			# block makes for finer timing.
+			self.listener.windowLength = 1
+
+		# Pick a tick length close to what averagePitch() would normally
+		# read, but which divides a 16th note evenly so measures line up.
+		sixteenthSeconds = 60.0 / tempo / 4
+		nominalTick = (self.listener.windowLength *
+					   self.listener.framesPerBuffer / float(self.rate))
+		self.ticksPerSixteenth = max(1,
+									 int(round(sixteenthSeconds / nominalTick)))
+		tickSeconds = sixteenthSeconds / self.ticksPerSixteenth
+		self.builder = MeasureBuilder(tempo, tickSeconds, smoothing,
+									  "onsets" if onsets else "grid",
+									  timeSignature)
+		self.measureTicks = (self.ticksPerSixteenth * 
+							 self.builder.sixteenthsPerMeasure)
+		# Smoothing runs the ticks through a note tracker first; it decides
+		# each tick half a 16th late.
+		self.tracker = None
+		if ( smoothing ):
+			self.tracker = NoteTracker(lag=max(1, self.ticksPerSixteenth / 2))
+
+		self.transcribedPart = stream.Part()
+		self.ticks = 0 # ticks processed so far
+		self.samplesRead = 0
+		self.wallSeconds = 0.0
+
+	@property
+	def audioSeconds(self):
+		return self.samplesRead / float(self.rate)
+
+	@property
+	def heardSeconds(self):
+		"""How far into the file detection has got."""
+		return min(self.samplesRead, self.source.frameCount) / float(self.rate)
+
+	def readTick(self):
+		"""Run one tick's worth of audio through averagePitch().
+
+		Block size is recomputed every tick from the running sample count,
+		so rounding never accumulates into drift against the tempo.
+		"""
+		self.ticks += 1
+		tickEnd = int(round(self.ticks * self.builder.tickSeconds * self.rate))
+		windowLength = self.listener.windowLength
+		self.listener.framesPerBuffer = max(1,
+							(tickEnd - self.samplesRead) / windowLength)
+		self.samplesRead += self.listener.framesPerBuffer * windowLength
+		self.listener.averagePitch()
+		if ( self.listener.detectedPitch ):
+			midi = int(round(self.listener.pitch.midi))
+		else:
+			midi = REST
+		return (self.listener.times[:1], [midi], [self.listener.onset])
+
+	def readMeasure(self):
+		"""Batched readTick(): reads a whole measure of audio at once, cuts
+		it into the same blocks averagePitch() would have read, detects 
+		them all in one go and averages each tick's estimates the same way.
+		Returns when each tick started (in seconds), the ticks as MIDI 
+		numbers (REST for no pitch; short at the end of the file), and 
+		whether each heard an onset.
+		"""
+		windowLength = self.listener.windowLength
+		measureEnd = int(round((self.ticks + self.measureTicks) * 
+							   self.builder.tickSeconds * self.rate))
+		blockSize = max(1, (measureEnd - self.samplesRead) / 
+							(self.measureTicks * windowLength))
+		block = self.source.read(measureEnd - self.samplesRead)
+		measureStart, self.samplesRead = self.samplesRead, measureEnd
+
+		samples = np.frombuffer(block, dtype=np.int16)
+		ticks = len(samples) / (blockSize * windowLength)
+		if ( ticks == 0 ):
+			raise EOFError("End of %s" % self.path)
+		frames = samples[:ticks*windowLength*blockSize].reshape(
+											ticks*windowLength, blockSize)
+		freqs, confidences = self.listener.detectFrames(frames)
+		tickFreqs = PitchDetect.averageFrequencies(
+											freqs.reshape(ticks, windowLength))
+		tickOnsets = self.listener.onsets.reshape(ticks, windowLength).any(axis=1)
+		tickStarts = measureStart + np.arange(ticks) * windowLength * blockSize
+		self.ticks += ticks
+		return (tickStarts / float(self.rate), PitchArray(tickFreqs).nearestMidi(),
+				tickOnsets)
+
+	def addMeasure(self, measure):
+		"""Add a finished measure to the part."""
+		if ( len(measure) > 1 and self.builder.smoothing and not self.onsets ):
+			self.listener.windowLength = 5
+		self.transcribedPart.append(measure)
+
+	def seek(self, tick):
+		"""Start reading at tick instead of the beginning. Starting on a
+		measure (a multiple of measureTicks) reads the same blocks a run
+		from the beginning would."""
+		self.ticks = tick
+		self.samplesRead = int(round(tick * self.builder.tickSeconds * self.rate))
+		self.source.seek(self.samplesRead)
+
+	def readAll(self):
+		"""Yields (times, ticks, onsets) from readMeasure() (or readTick())
+		until the file runs out."""
+		while True:
+			try:
+				if ( self.batch ):
+					yield self.readMeasure()
+				else:
+					yield self.readTick()
+			except EOFError:
+				return
+
+	def finish(self, start):
+		self.source.close()
+		self.samplesRead = min(self.samplesRead, self.source.frameCount)
+		self.wallSeconds = time.time() - start
+
+	def run(self):
+		"""Transcribe the whole file. Returns the transcribed part."""
+		start = time.time()
+		tempoObject = tempo.MetronomeMark(None, self.tempo,
+										  note.Note(type="quarter"))
+		self.transcribedPart.insert(0, tempoObject)
+
+		quantizer = Quantizer(self.builder, self.tracker)
+		for (times, ticks, onsets) in self.readAll():
+			for measure in quantizer.add(times, ticks, 
+										 onsets if self.onsets else None,
+										 until=self.heardSeconds):
+				self.addMeasure(measure)
+		for measure in quantizer.flush(self.heardSeconds):
+			self.addMeasure(measure)
+
+		self.finish(start)
+		return self.transcribedPart
+
+	def streamMidi(self, fp=None):
+		"""Transcribe the whole file straight to MIDI note events (see
+		MidiEventWriter) at fp, or in memory. Returns the writer."""
+		start = time.time()
+		writer = MidiEventWriter(fp, bpm=self.tempo)
+		waiting = deque() # (time, onset) of ticks the tracker hasn't decided
+		for (times, ticks, onsets) in self.readAll():
+			if ( not self.onsets ):
+				onsets = np.zeros(len(ticks), dtype=bool)
+			if ( self.tracker is None ):
+				decided = ticks
+			else:
+				waiting.extend(zip(times, onsets))
+				decided = self.tracker.extend(ticks)
+				stamps = [waiting.popleft() for midi in decided]
+				times = [seconds for (seconds, onset) in stamps]
+				onsets = [onset for (seconds, onset) in stamps]
+			for (seconds, midi, onset) in zip(times, decided, onsets):
+				writer.update(seconds, midi, onset)
+		if ( self.tracker is not None ):
+			for midi in self.tracker.flush():
+				(seconds, onset) = waiting.popleft()
+				writer.update(seconds, midi, onset)
+		writer.close(self.heardSeconds)
+		self.finish(start)
+		return writer
+
+	def write(self, fp, format="musicxml"):
+		"""Write the transcription to disk ("musicxml" or "midi")."""
+		return self.transcribedPart.write(format, fp=fp)
+
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description="Transcribe a WAV file.")
+	parser.add_argument("wav", help="recording to transcribe")
+	parser.add_argument("--tempo", type=int, default=60)
+	parser.add_argument("--time", default="4/4", help="time signature")
+	parser.add_argument("--smooth", action="store_true",
+						help="smooth input audio (same as the GUI checkbox)")
+	parser.add_argument("--xml", help="MusicXML output path")
+	parser.add_argument("--midi", help="MIDI output path")
+	parser.add_argument("--midi-events", dest="midiEvents",
+						help="MIDI output path, written straight from the "
+							 "pitch track (no score; ignores --xml/--midi)")
+	parser.add_argument("--engine", help="pitch engine (see estimators.py)")
+	parser.add_argument("--no-batch", dest="batch", action="store_false",
+						help="detect one tick at a time instead of a measure")
+	parser.add_argument("--no-onsets", dest="onsets", action="store_false",
+						help="snap notes to a 16th grid instead of onsets")
+	args = parser.parse_args()
+
+	transcription = OfflineTranscription(args.wav, args.tempo, args.smooth,
+										 args.batch, args.engine, args.onsets,
+										 args.time)
+	if ( args.midiEvents ):
+		transcription.streamMidi(args.midiEvents)
+	else:
+		transcription.run()
+		if ( args.xml ): transcription.write(args.xml, "musicxml")
+		if ( args.midi ): transcription.write(args.midi, "midi")
+	print "%0.1f sec of audio in %0.1f sec (%0.1fx real time)" % (
+		transcription.audioSeconds, transcription.wallSeconds,
+		transcription.audioSeconds / max(transcription.wallSeconds, 1e-6))
@@ -0,0 +1,141 @@
+from features import BlockFeatures
+from collections import deque
+import numpy as np
+
+class OnsetDetector(object):
+	"""Finds note onsets (attacks) in a stream of audio frames by spectral
+	flux: how much energy appeared in the spectrum since the last frame,
+	summed over frequency bins where it went up. A new note, even one at
+	the same pitch as the last, makes a burst of it.
+
+	Each bin is compared with the loudest of its neighbours (spreadBins
+	either side) in the frame before, rather than with itself. A steady
+	low note in a short frame wobbles between neighbouring bins from one
+	frame to the next as its phase turns, which plain flux mistakes for
+	an attack; a real attack raises bins the last frame had nothing near.
+
+	Peak picking is adaptive: a frame is an onset if its flux beats ratio
+	times the median flux of the previous windowFrames frames plus delta,
+	and is at least as big as the frame before. After an onset, nothing
+	else counts for minGapFrames frames, so one attack isn't reported
+	twice.
+
+	Works on the spectra pitch detection already has (see
+	BlockFeatures.spectrum); frames the noise gate closed on go in as
+	silence().
+
+	Example:
+	detector = OnsetDetector()
+	onsets = detector.update(BlockFeatures.spectra(frames)) # one per frame
+	"""
+	# CITE: Dixon, "Onset detection revisited" (2006)
+	# CITE: Boeck & Widmer, "Maximum filter vibrato suppression for onset
+	# detection" (2013), for spreadBins
+	def __init__(self, ratio=2.0, delta=0.002, windowFrames=10,
+				 minGapFrames=3, compression=1.0, spreadBins=1):
+		self.ratio = ratio
+		self.delta = delta
+		self.windowFrames = windowFrames
+		self.minGapFrames = minGapFrames
+		self.compression = compression # log(1 + compression * magnitude)
+		self.spreadBins = spreadBins
+		self.reset()
+
+	def reset(self):
+		self.previous = None # last frame's (compressed) spectrum
+		self.recent = deque() # flux of the last windowFrames frames
+		self.lastFlux = 0.0
+		self.framesSeen = 0
+		self.lastOnset = None # frame number of the last onset
+		self.onsetCount = 0
+
+	@classmethod
+	def spread(_class, spectra, bins):
+		"""Each bin of each row replaced by the largest within bins of it."""
+		spread = spectra.copy()
+		for shift in xrange(1, bins + 1):
+			np.maximum(spread[:, shift:], spectra[:, :-shift], spread[:, shift:])
+			np.maximum(spread[:, :-shift], spectra[:, shift:], spread[:, :-shift])
+		return spread
+
+	def flux(self, spectra):
+		"""Spectral flux of each row of spectra against the row before
+		(the first against the last frame seen, or silence)."""
+		if ( spectra.shape[1] == 0 ):
+			return np.zeros(len(spectra))
+		compressed = np.log1p(self.compression * spectra)
+		previous = self.previous
+		if ( previous is None ):
+			previous = np.zeros(compressed.shape[1])
+		elif ( len(previous) != compressed.shape[1] ):
+			previous = compressed[0] # block size changed: start afresh
+		before = np.vstack((previous[np.newaxis], compressed[:-1]))
+		self.previous = compressed[-1]
+		before = self.spread(before, self.spreadBins)
+		return np.maximum(compressed - before, 0).mean(axis=1)
+
+	def silence(self, count=1):
+		"""Skip count frames the noise gate closed on, without their
+		spectra: whatever comes next is measured against silence. They
+		aren't onsets, and they stay out of the median (a run of zeros
+		there would make the tail of the next attack look like another)."""
+		if ( self.previous is not None ):
+			self.previous = np.zeros(len(self.previous))
+		self.lastFlux = 0.0
+		self.framesSeen += count
+		return np.zeros(count, dtype=bool)
+
+	def update(self, spectra):
+		"""Feed in a frames x bins array of magnitude spectra, in order.
+		Returns a boolean array: which of those frames are onsets."""
+		spectra = np.asarray(spectra)
+		onsets = np.zeros(len(spectra), dtype=bool)
+		if ( len(spectra) == 0 ):
+			return onsets
+		fluxes = self.flux(spectra)
+		for (i, flux) in enumerate(fluxes):
+			median = np.median(self.recent) if self.recent else 0.0
+			threshold = self.ratio * median + self.delta
+			waited = (self.lastOnset is None or
+					  self.framesSeen - self.lastOnset >= self.minGapFrames)
+			if ( flux > threshold and flux >= self.lastFlux and waited ):
+				onsets[i] = True
+				self.lastOnset = self.framesSeen
+				self.onsetCount += 1
+
+			self.recent.append(flux)
+			if ( len(self.recent) > self.windowFrames ):
+				self.recent.popleft()
+			self.lastFlux = flux
+			self.framesSeen += 1
+		return onsets
+
+	@classmethod
+	def test(_class):
+		"""Tests for the OnsetDetector class."""
+		rate, size = 44100, 1002 # about what offline.py reads at 60 bpm
+		def tone(freq, seconds, amplitude=8000):
+			t = np.arange(int(seconds * rate)) / float(rate)
+			return amplitude * np.sin(2 * np.pi * freq * t)
+		def onsetTimes(samples):
+			frames = samples[:len(samples) / size * size].reshape(-1, size)
+			onsets = _class().update(BlockFeatures.spectra(frames))
+			return list(np.flatnonzero(onsets) * size / float(rate))
+
+		# Held low notes (G2, E2) have one onset, at the start
+		for freq in (98.0, 82.41, 440.0):
+			assert( onsetTimes(tone(freq, 3.0)) == [0.0] )
+		# A re-attack of the same note is found
+		decay = np.exp(-3 * np.arange(rate) / float(rate))
+		note = tone(98.0, 1.0) * decay
+		onsets = onsetTimes(np.concatenate((note, note)))
+		assert( len(onsets) == 2 and abs(onsets[1] - 1.0) < 0.05 )
+		# Gated frames count as silence: sound after them is an onset
+		detector = _class()
+		frames = tone(98.0, 0.5)[:10 * size].reshape(10, size)
+		assert( detector.update(BlockFeatures.spectra(frames)).sum() == 1 )
+		assert( not detector.silence(5).any() )
+		assert( detector.update(BlockFeatures.spectra(frames))[0] )
+
+if __name__ == '__main__':
+	OnsetDetector.test()
@@ -0,0 +1,189 @@
+from measurebuilder import *
+from notetracking import *
+from threading import Thread, Event, Lock
+import Queue
+import time
+
+class TranscriptionPipeline(Thread):
+	"""Runs the whole live transcription pipeline (capture, pitch and onset
+	detection, the note tracker and Quantizer, measure building) on one
+	worker thread, paced by the audio input itself: each step blocks on
+	reading a block, so there's no timer to poll. If the step falls behind
+	and blocks pile up in the capture queue, the next step detects all of
+	them in one batch (see PitchDetect.catchUp()).
+
+	How well it keeps up is measured against the audio: a step's deadline
+	is the moment the last of its audio was captured, and lateness is how
+	long after that the step finished. meanLateness, maxLateness and
+	jitter (the standard deviation of lateness) cover the recording so
+	far; stepCounter counts steps, catchUpCounter the batched ones, and
+	blocksDropped the captured blocks that were thrown away unheard.
+
+	Nothing here touches Tk. Everything the UI needs comes out of
+	self.events, a thread-safe queue of (kind, value) pairs for the Tk
+	main loop to drain (e.g. from root.after()):
+		("measure", music21.stream.Measure()): a finished measure
+		("estimate", (seconds, midi, onset)): every tick as it's heard,
+			seconds after begin(), midi being REST for no pitch (e.g. for
+			a MidiEventWriter)
+		("seconds", int): whole seconds of audio recorded so far
+		("ended", None): the source ran out (files, synthetic audio)
+
+	The thread starts paused; begin() starts a recording, pause() and
+	resume() pause and carry on, and stop() ends the thread for good.
+	While paused it blocks, so it uses no CPU.
+
+	Example:
+	pipeline = TranscriptionPipeline(PitchDetect(channels=1))
+	pipeline.start()
+	pipeline.begin(MeasureBuilder(90))
+	kind, value = pipeline.events.get()
+	"""
+	def __init__(self, listener):
+		Thread.__init__(self)
+		self.daemon = True
+		self.listener = listener
+		self.smoothing = False # "Smooth Input Audio", set by the UI
+		self.events = Queue.Queue()
+		self.stopped = False
+		self.resumed = Event() # set while recording
+		self.wakeup = Event() # set by stop() to cut a wait short
+		self.lock = Lock() # held for each step, so begin() never cuts one
+		self.builder = None
+		self.quantizer = None
+		self.startTime = 0.0 # audio clock time recording began
+		self.seconds = 0
+		self.wallStart = None # wall clock time the audio clock was at 0
+		self.resetStats()
+
+	@property
+	def paused(self):
+		return not self.resumed.isSet()
+
+	def begin(self, builder):
+		"""Start a new recording, cut into measures by builder."""
+		with self.lock:
+			self.builder = builder
+			# "Smooth Input Audio" decides each tick half a 16th late
+			lag = int(builder.sixteenthTimerTicks / 2)
+			tracker = NoteTracker(lag=max(1, lag))
+			# Measures are timed by the audio clock, not by counting ticks
+			self.quantizer = Quantizer(builder, tracker,
+									   start=self.listener.clock)
+			self.startTime = self.listener.clock
+			self.seconds = 0
+			self.resetStats()
+		self.resume()
+
+	def pause(self):
+		self.resumed.clear()
+
+	def resume(self):
+		if ( self.quantizer is not None ):
+			self.wallStart = None # paused time isn't lateness
+			self.resumed.set()
+
+	def stop(self):
+		self.stopped = True
+		self.wakeup.set()
+		self.resumed.set() # let a paused thread see it's stopped
+
+	def resetStats(self):
+		self.stepCounter = 0
+		self.catchUpCounter = 0
+		self.lateTotal = 0.0
+		self.lateSquares = 0.0
+		self.maxLateness = 0.0
+
+	@property
+	def meanLateness(self):
+		return self.lateTotal / self.stepCounter if self.stepCounter else 0.0
+
+	@property
+	def jitter(self):
+		if ( self.stepCounter == 0 ):
+			return 0.0
+		mean = self.meanLateness
+		return max(0.0, self.lateSquares / self.stepCounter - mean * mean) ** 0.5
+
+	@property
+	def blocksDropped(self):
+		queue = getattr(getattr(self.listener, "source", None), "queue", None)
+		return getattr(queue, "blocksDropped", 0)
+
+	def recordLateness(self, clock):
+		"""Account for a step that's heard the audio up to clock."""
+		now = time.time()
+		lateness = 0.0
+		if ( self.wallStart is not None ):
+			lateness = now - (self.wallStart + clock)
+		if ( self.wallStart is None or lateness < 0 ):
+			# Anchor to the earliest a step has kept up, so a late first
+			# step (or a file read faster than realtime) isn't the baseline
+			self.wallStart = now - clock
+			lateness = 0.0
+		self.stepCounter += 1
+		self.lateTotal += lateness
+		self.lateSquares += lateness * lateness
+		self.maxLateness = max(self.maxLateness, lateness)
+
+	def run(self):
+		"""Implementation of threading.Thread() run function, which is the
+		thread's main loop."""
+		while not self.stopped:
+			if ( self.paused ):
+				self.resumed.wait()
+				continue
+			with self.lock:
+				heard = self.step()
+			if ( not heard ):
+				self.wakeup.wait(0.1) # input failed; don't spin on it
+
+	def step(self):
+		"""Listen to one block and push it through the pipeline. Returns
+		whether anything was heard."""
+		listener = self.listener
+		try:
+			caughtUp = (getattr(listener, "backlog", 0) > 1 
+						and listener.catchUp() > 0)
+			if ( not caughtUp ):
+				listener.smoothedPitch()
+		except EOFError:
+			for measure in self.quantizer.flush(until=listener.clock):
+				self.events.put(("measure", measure))
+			self.pause()
+			self.events.put(("ended", None))
+			return True
+		if ( len(listener.times) == 0 ):
+			return False
+
+		if ( caughtUp ):
+			self.catchUpCounter += 1
+			pitches = listener.smoothed
+			(times, onsets) = (listener.times, listener.onsets)
+		else:
+			pitches = [listener.pitch if listener.detectedPitch else None]
+			(times, onsets) = (listener.times[-1:], [listener.onset])
+
+		# Ticks are stored as MIDI numbers, stamped with when they were
+		# heard; notes only get made once a measure is complete.
+		midis = [int(round(pitch.midi)) if pitch is not None else REST
+				 for pitch in pitches]
+		for (time, midi, onset) in zip(times, midis, onsets):
+			self.events.put(("estimate", (time - self.startTime, midi,
+										  bool(onset))))
+		self.builder.smoothing = self.smoothing
+		self.quantizer.tracking = self.smoothing
+		measures = self.quantizer.add(times, midis, onsets,
+									  until=listener.clock)
+		for measure in measures:
+			if ( len(measure) > 1 and self.smoothing ):
+				listener.windowLength = 5
+			self.events.put(("measure", measure))
+
+		seconds = int(listener.clock - self.startTime)
+		if ( seconds != self.seconds ):
+			self.seconds = seconds
+			self.events.put(("seconds", seconds))
+		self.recordLateness(listener.clock)
+		return True
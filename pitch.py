@@ -1,5 +1,6 @@
 from numbers import Number
 from math import log
+from collections import OrderedDict
 
 class Util(object):
 	@classmethod
@@ -18,16 +19,44 @@ class Pitch(object):
 	associated MIDI and note-name values. Provides conversion functions
 	to convert between note names, MIDI values, and frequencies, as well as
 	basic math and pitch math (i.e. tuning, harmonic equivalency).
+	
+	Pitches get made on every tick, so they're kept small (__slots__), the 
+	MIDI value and note name are only worked out when first asked for, and
+	conversions go through lookup tables for the 128 MIDI notes.
 	"""
+	__slots__ = ("freq", "_midi", "_note")
 	
 	# noteNames = ["C", "C#", "D", "Eb", "E", "F", "F#", "G", "Ab", "A", "Bb", "B"]
 	noteNames = ["C", "C#", "D", "E-", "E", "F", "F#", "G", "A-", "A", "B-", "B"]
+	precision = 3
+	
+	# Lookup tables, indexed by MIDI note (0-127)
+	midiFreqs = [2**((midi-69)/12.0) * 440.0 for midi in xrange(128)]
+	midiNames = ["%s%d" % (noteNames[midi % 12], (midi / 12) - 1) 
+				 for midi in xrange(128)]
+	midiPitches = [None] * 128 # Pitch objects, made as they're needed
+	
+	# Parsed note names (e.g. "F#3" -> 54), least recently used dropped first
+	noteCache = OrderedDict()
+	noteCacheSize = 256
+	semitonesPerLog = 12 / log(2) # 12 * log2(x) == semitonesPerLog * log(x)
 
 	def __init__(self, frequency):
-		self.precision = 3
 		self.freq = round(float(frequency), self.precision) 
-		self.midi = Pitch.freqToMidi(self.freq)
-		self.note = Pitch.midiToNote(self.midi)
+		self._midi = None
+		self._note = None
+
+	@property
+	def midi(self):
+		if ( self._midi is None ):
+			self._midi = Pitch.freqToMidi(self.freq)
+		return self._midi
+
+	@property
+	def note(self):
+		if ( self._note is None ):
+			self._note = Pitch.midiToNote(self.midi)
+		return self._note
 	
 	# Type representations
 	def __repr__(self): return "Pitch(%0.3f)" % self.freq
@@ -62,7 +91,7 @@ class Pitch(object):
 		
 	def roughlyEqual(self, other, tolerance=0.1):
 		"""Returns equality between two pitches given a tolerance."""
-		return abs(self.pitch - other) < tolerance
+		return abs(self.freq - Util.freqOrNumber(other)) < tolerance
 
 	def roughlyEqualHarmonically(self, other, tolerance=0.009):
 		"""Tests equality of two pitches regardless of harmonic difference.
@@ -88,10 +117,19 @@ class Pitch(object):
 		For example, Pitch(438.500).inTune() == -1.500 Hz as it's 
 		3 away from 440 Hz, its nearest neighbor.
 		"""
-		nearestNeighbor = Pitch(self.noteToFreq(self.note))
+		nearestNeighbor = Pitch.forMidi(int(round(self.midi)))
 		pitchDelta = self.freq - nearestNeighbor.freq 
 		return (pitchDelta, nearestNeighbor)
 	
+	@classmethod
+	def forMidi(_class, midi):
+		"""The (shared) Pitch for a whole MIDI note."""
+		if ( 0 <= midi < 128 ):
+			if ( _class.midiPitches[midi] is None ):
+				_class.midiPitches[midi] = Pitch(_class.midiFreqs[midi])
+			return _class.midiPitches[midi]
+		return Pitch(_class.midiToFreq(midi))
+	
 	@classmethod
 	def freqToMidi(_class, freq):
 		"""Converts a pitch into its corresponding MIDI note representation.
@@ -100,7 +138,7 @@ class Pitch(object):
 		An octave is represented as 12 semitones.
 		""" 
 		# CITE: http://www.phys.unsw.edu.au/jw/notes.html
-		midiNote = 69 + 12 * log(freq / 440.0, 2)
+		midiNote = 69 + _class.semitonesPerLog * log(freq / 440.0)
 		return round(midiNote, 2)
 
 	@classmethod
@@ -111,6 +149,8 @@ class Pitch(object):
 	@classmethod
 	def midiToFreq(_class, midi):
 		"""Converts a MIDI note value to a frequency."""
+		if ( midi == int(midi) and 0 <= midi < 128 ):
+			return _class.midiFreqs[int(midi)]
 		midiFreq = 2**((midi-69)/12.0) * 440.0
 		return midiFreq
 		
@@ -118,33 +158,33 @@ class Pitch(object):
 	def midiToNote(_class, midi):
 		"""Get the standard written representation of a pitch (note + octave)
 		from a MIDI note representation."""
-		octave = (int(midi) / 12) - 1
-		name = _class.noteNames[ int(round(midi)) % 12  ]
+		nearest = int(round(midi))
+		if ( 0 <= nearest < 128 ):
+			return _class.midiNames[nearest]
+		octave = (nearest / 12) - 1
+		name = _class.noteNames[ nearest % 12  ]
 		return "%s%d" % (name, octave)
 		
 	@classmethod
 	def noteToMidi(_class, note):
 		"""Takes a note in the form of C4 of F#3 and returns its MIDI value."""
-		return int(round(_class.freqToMidi(_class.noteToFreq(note))))
+		cache = _class.noteCache
+		if ( note in cache ):
+			midi = cache.pop(note) # re-inserted below as most recent
+		else:
+			# Takes a note in the form A(-/#)N. 
+			letter = note[0:len(note)-1]
+			octave = int(note[-1])
+			midi = (octave + 1) * 12 + _class.noteNames.index(letter)
+			if ( len(cache) >= _class.noteCacheSize ):
+				cache.popitem(last=False)
+		cache[note] = midi
+		return midi
 
 	@classmethod
 	def noteToFreq(_class, note, precision=3):
 		"""Takes a note in the form of C4 of F#3 and returns its frequency."""
-		# Useful constants
-		# CITE: http://www.booki.cc/csound/pitch-and-frequency/
-		aToCTuningOffset = 9
-		semitoneRatio = 2**(1.0/12)
-				
-		# Takes a note in the form A(-/#)N. 
-		letter = note[0:len(note)-1]
-		octave = note[-1]
-		offsetNoteIndex = _class.noteNames.index(letter) - aToCTuningOffset
-		
-		octaveComponent = 2**int(octave)
-		noteComponent = semitoneRatio**offsetNoteIndex
-		frequency = round((275*octaveComponent*noteComponent/10.0), precision)
-
-		return frequency
+		return round(_class.midiToFreq(_class.noteToMidi(note)), precision)
 	
 	@classmethod
 	def test(_class):
@@ -177,6 +217,9 @@ class Pitch(object):
 		assert( Pitch(440)*0 == None )
 		assert( hash(Pitch(440)) == hash(Pitch(440)) )				
 		assert( hash(Pitch(333)) != hash(Pitch(333.01)))
+		assert( Pitch(438.5).inTune()[1] is Pitch(440).inTune()[1] )
+		assert( Pitch(261.0).note == "C4" and Pitch(258.0).note == "C4" )
+		assert( _class.noteToMidi("C#4") == 61 and "C#4" in _class.noteCache )
 		
 if __name__ == '__main__':
 	Pitch.test()
\ No newline at end of file
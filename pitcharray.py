@@ -0,0 +1,141 @@
+from pitch import *
+import numpy as np
+
+class PitchArray(object):
+	"""A whole track of pitches at once: NumPy arrays of frequency and MIDI
+	values with vectorized versions of the Pitch conversions. A frequency
+	of 0 means "no pitch" (a rest); its MIDI value is NaN.
+
+	Example:
+	track = PitchArray([440, 0, 466.2, 220.5])
+	track.notes() # ["A4", None, "B-4", "A3"]
+	track.cents() # deviation from the nearest note, in cents
+	track.snap().freq # frequencies of the nearest notes
+	"""
+	def __init__(self, freqs):
+		self.freq = np.round(np.asarray(freqs, dtype=np.float64),
+							 Pitch.precision)
+		self.freq[~(self.freq > 0)] = 0.0 # NaN, negative -> no pitch
+		self.midi = PitchArray.freqToMidi(self.freq)
+
+	def __len__(self): return len(self.freq)
+	def __repr__(self): return "PitchArray(%r)" % list(self.freq)
+
+	def __getitem__(self, index):
+		"""A Pitch (or None) for an integer index, a PitchArray otherwise."""
+		if ( isinstance(index, (int, long, np.integer)) ):
+			freq = self.freq[index]
+			return Pitch(freq) if freq > 0 else None
+		return PitchArray(self.freq[index])
+
+	@property
+	def voiced(self):
+		"""Mask of the entries that have a pitch."""
+		return self.freq > 0
+
+	# Conversions
+	@classmethod
+	def fromPitches(_class, pitches):
+		"""From a list of Pitch objects (or None for no pitch)."""
+		return _class([p.freq if isinstance(p, Pitch) else 0.0
+					   for p in pitches])
+
+	@classmethod
+	def fromMidi(_class, midis):
+		"""From MIDI values (NaN or negative for no pitch)."""
+		return _class(_class.midiToFreq(midis))
+
+	def toPitches(self):
+		"""A list of Pitch objects, with None for no pitch."""
+		return [Pitch(freq) if freq > 0 else None for freq in self.freq]
+
+	@classmethod
+	def freqToMidi(_class, freqs):
+		"""Vectorized Pitch.freqToMidi(); NaN where there's no pitch."""
+		freqs = np.asarray(freqs, dtype=np.float64)
+		midi = np.empty(freqs.shape)
+		midi.fill(np.nan)
+		voiced = freqs > 0
+		midi[voiced] = np.round(69 + 12 * np.log2(freqs[voiced] / 440.0), 2)
+		return midi
+
+	@classmethod
+	def midiToFreq(_class, midis):
+		"""Vectorized Pitch.midiToFreq(); 0 where there's no pitch."""
+		midis = np.asarray(midis, dtype=np.float64)
+		freqs = np.zeros(midis.shape)
+		voiced = ~np.isnan(midis)
+		voiced[voiced] = midis[voiced] >= 0
+		freqs[voiced] = 2**((midis[voiced] - 69) / 12.0) * 440.0
+		return freqs
+
+	def nearestMidi(self):
+		"""Nearest whole MIDI note for each entry; -1 where there's no pitch."""
+		nearest = np.empty(len(self), dtype=np.int32)
+		nearest.fill(-1)
+		voiced = self.voiced
+		nearest[voiced] = np.round(self.midi[voiced]).astype(np.int32)
+		return nearest
+
+	def notes(self):
+		"""Vectorized Pitch.midiToNote(): note names, None for no pitch."""
+		nearest = self.nearestMidi()
+		names = np.array(Pitch.midiNames + [None], dtype=object)
+		inTable = (nearest >= 0) & (nearest < 128)
+		index = np.where(inTable, nearest, len(names) - 1)
+		result = names[index]
+		for i in np.nonzero(self.voiced & ~inTable)[0]:
+			result[i] = Pitch.midiToNote(nearest[i]) # off the end of the table
+		return list(result)
+
+	# Tuning
+	def snap(self):
+		"""The nearest whole notes, as a PitchArray."""
+		return PitchArray.fromMidi(np.where(self.voiced, self.nearestMidi(),
+											np.nan))
+
+	def cents(self):
+		"""Deviation from the nearest note in cents (100 to a semitone);
+		NaN where there's no pitch."""
+		return 100 * (self.midi - np.round(self.midi))
+
+	def inTune(self):
+		"""Vectorized Pitch.inTune(): the difference in Hz from the nearest
+		note, and the nearest notes as a PitchArray."""
+		neighbours = self.snap()
+		return (np.where(self.voiced, self.freq - neighbours.freq, np.nan),
+				neighbours)
+
+	def roughlyEqualHarmonically(self, other, tolerance=0.009):
+		"""Vectorized Pitch.roughlyEqualHarmonically(): a mask of entries
+		that are (roughly) a whole-number multiple or fraction of other,
+		which can be a number, a Pitch or a PitchArray."""
+		if ( isinstance(other, PitchArray) ):
+			that = other.freq
+		else:
+			that = float(Util.freqOrNumber(other))
+		this, that = np.broadcast_arrays(self.freq, that)
+		voiced = (this > 0) & (that > 0)
+		ratio = np.ones(this.shape)
+		ratio[voiced] = (np.maximum(this, that)[voiced] /
+						 np.minimum(this, that)[voiced])
+		return voiced & (np.abs(ratio - np.round(ratio)) < tolerance)
+
+	@classmethod
+	def test(_class):
+		"""Tests for the PitchArray class (they mirror Pitch.test())."""
+		freqs = [440.0, 466.16, 130.81, 87.307, 0]
+		track = _class(freqs)
+		assert( track.notes() == ["A4", "B-4", "C3", "F2", None] )
+		assert( list(track.nearestMidi()) == [69, 70, 48, 41, -1] )
+		assert( list(track.freq) == [Pitch(f).freq if f else 0 for f in freqs] )
+		assert( np.allclose(track.midi[:4], [Pitch(f).midi for f in freqs[:4]]) )
+		assert( np.allclose(track.snap().freq[:1], [440.0]) )
+		assert( abs(_class([438.5]).inTune()[0][0] - Pitch(438.5).inTune()[0]) < 0.01 )
+		assert( list(_class([440, 1320, 445, 0]).roughlyEqualHarmonically(220))
+				== [True, True, False, False] )
+		assert( track[0] == Pitch(440) and track[4] is None )
+		assert( _class.fromPitches(track.toPitches()).notes() == track.notes() )
+
+if __name__ == '__main__':
+	PitchArray.test()
@@ -1,73 +1,293 @@
 from microphone import *
 from pitch import *
-from numpy import fromstring, int16, average, mean, std, array, append, sqrt
-import analyse, struct
+from features import *
+from ringbuffer import *
+from estimators import *
+from smoothing import *
+from onsets import *
+import numpy as np
+import warnings
 
 class PitchDetect(Microphone):
 	"""A pitch detection class that supports detection of individual pitches
 	as well as a moving-window average of pitches with outliers removed.
 	
+	smoothedPitch() is the streaming version of averagePitch(): one block 
+	per call, with the window sliding over the most recent estimates.
+	
+	Each block or frame also goes through an OnsetDetector; self.onsets
+	says which of the last listen()'s estimates started a note, and 
+	self.onset whether any did. self.times says when each estimate's
+	audio started, in seconds on the source's sample clock (not the wall
+	clock, so it's immune to scheduling hiccups). With useFrames(), that's
+	the start of the hop-long stretch in the middle of the frame, so the
+	times line up with the block path's (which are a block's middle less
+	half a block) rather than running half a window early.
+	
+	The pitch estimation engine can be picked per instance: "analyse"
+	(SoundAnalyse, the default when it's installed), "autocorrelation", 
+	"yin" or "mcleod"; see estimators.py.
+	
 	Example:
 	from pitchdetect import *
-	listener = PitchDetect(channels=1)
+	listener = PitchDetect(channels=1, engine="yin")
 	while True:
-		listener.averagePitch()
-		print listener.pitch
+		listener.smoothedPitch()
+		print listener.pitch, listener.confidence
 	"""
-	def __init__(self, **kwargs):
+	def __init__(self, engine=None, **kwargs):
 		super(PitchDetect, self).__init__(**kwargs)
 		# Amplitude in terms of RMS amplitude
 		# Rules of thumb, gained through empirical testing:
 		# 	Silence / background jitter: RMS < 1
 		# 	Someone talking next to laptop: 0.5 - 5
 		# 	String instrument: 3-15
-		self.amplitudeThreshold = 0.5
+		# The gate adapts to the noise floor, but never opens below 0.5.
+		self.gate = NoiseGate(minThreshold=0.5)
 		self.windowLength = 3 # samples per window
+		# Lowest pitch worth looking for is E2 (82 Hz)
+		self.estimator = makeEstimator(engine, rate=self.rate, 
+									   minFrequency=82.0)
+		self.pitch = None # last estimate (a Pitch), or None
+		self.detectedNoise = False # was the last block loud enough to pitch?
+		self.detectedPitch = False
+		self.confidence = 0.0 # how sure the estimator was of the last pitch
+		self.features = None # BlockFeatures of the last block heard
+		self.framer = None # set by useFrames() for overlapping analysis
+		self.pitches = [] # every estimate from the last listen()
+		self.smoother = PitchSmoother(self.windowLength)
+		self.smoothed = [] # the same, smoothed (see smoothedPitch)
+		self.rawPitch = None # last unsmoothed estimate (see smoothedPitch)
+		self.onsetDetector = OnsetDetector()
+		self.onsets = np.zeros(0, dtype=bool) # one per entry in self.pitches
+		self.times = np.zeros(0) # ditto
+		self.rangeChecked = False # has checkRange() looked at a frame yet?
+
+	def useFrames(self, windowSize=4096, hopSize=512):
+		"""Analyse overlapping frames instead of raw blocks: windowSize 
+		samples per estimate, one estimate every hopSize samples. Each 
+		listen() then reads one hop of audio.
+		"""
+		self.framer = Framer(windowSize, hopSize)
+		self.framesPerBuffer = hopSize
+		self.rangeChecked = False # frames are a new size
+		# A long window has room for a few periods of lower notes
+		self.estimator.minFrequency = min(82.0, 3.0 * self.rate / windowSize)
+
+	def checkRange(self, frameSize):
+		"""Warn if frames of frameSize samples are too short for the
+		estimator to reach its minFrequency. Only the first frame analysed
+		is checked: that's the size that was asked for, where later ones
+		can be the short tail of a file."""
+		if ( self.rangeChecked ):
+			return
+		self.rangeChecked = True
+		lowest = self.estimator.lowestFrequency(frameSize)
+		if ( lowest > self.estimator.minFrequency + 0.5 ):
+			warnings.warn("%d-sample frames can't hold notes below %0.1f Hz "
+						  "(%s); use bigger blocks or useFrames() for lower "
+						  "notes." % (frameSize, lowest, Pitch(lowest).note))
+
+	@property
+	def clock(self):
+		"""How much audio has been read from the source, in seconds."""
+		return getattr(self.source, "framesRead", 0) / float(self.rate)
+
+	@property
+	def backlog(self):
+		"""How many captured blocks are waiting to be read (see 
+		QueuedSource); always 0 when reading inline."""
+		return len(getattr(self.source, "queue", ()))
+
+	@property
+	def onset(self):
+		"""Did the last listen() hear a note start?"""
+		return bool(self.onsets.any())
 
 	def averagePitch(self):	
 		"""Gets the moving average of input pitches."""
 		self.detectedPitch = False
-
-		def removeOutliers(a):
-			deviations = 2
-			mu = mean(a)
-			s = std(a)
-			return filter(lambda x: mu-deviations*s < x < mu+deviations*s, a)
-
-		samples = []
+		freqs = []
+		onsets = []
+		times = []
 		for i in xrange(self.windowLength):
 			self.listen()
-			if ( self.detectedNoise ):
-				samples.append(self.pitch)
-		freqs = [sample.freq for sample in samples if isinstance(sample, Pitch)]				
-		cleaned = removeOutliers(freqs)		
-		if ( len(cleaned) > 0 ):
+			onsets.append(self.onsets)
+			times.append(self.times)
+			if ( self.detectedNoise and isinstance(self.pitch, Pitch) ):
+				freqs.append(self.pitch.freq)
+			else:
+				freqs.append(0.0)
+		self.onsets = np.concatenate(onsets)
+		self.times = np.concatenate(times)
+		average = PitchDetect.averageFrequencies(np.array([freqs]))[0]
+		if ( average > 0 ):
 			self.detectedPitch = True
-			self.pitch = Pitch(sum(cleaned) / len(cleaned))
+			self.pitch = Pitch(average)
+
+	def smoothedPitch(self):
+		"""Listens to one block and updates the sliding-window average of
+		recent pitches with it. Same idea as averagePitch(), but costs one
+		block instead of windowLength, and the windows overlap.
+		Sets self.pitch (smoothed), self.rawPitch and self.detectedPitch.
+		"""
+		self.listen()
+		self.smoothPitches()
+
+	def smoothPitches(self):
+		"""Slide the smoothing window over the estimates in self.pitches.
+		self.smoothed gets the smoothed pitch (or None) after each one."""
+		if ( self.smoother.windowLength != self.windowLength ):
+			self.smoother.resize(self.windowLength)
+		self.smoothed = []
+		for pitch in self.pitches:
+			self.smoother.update(pitch.freq if isinstance(pitch, Pitch) else 0)
+			freq = self.smoother.freq
+			self.smoothed.append(Pitch(freq) if freq is not None else None)
+		self.rawPitch = self.pitch
+		self.detectedPitch = self.smoother.freq is not None
+		self.pitch = Pitch(self.smoother.freq) if self.detectedPitch else None
+
+	@classmethod
+	def averageFrequencies(_class, freqs, deviations=2):
+		"""The averaging behind averagePitch(), for a whole batch at once:
+		freqs is a windows x estimates array (0 = no pitch), and each row's
+		mean is taken after dropping estimates more than deviations
+		standard deviations from it. Rows with nothing left come out 0.
+		"""
+		valid = freqs > 0
+		counts = np.maximum(valid.sum(axis=1), 1)
+		mu = np.where(valid, freqs, 0).sum(axis=1) / counts
+		deltas = np.abs(freqs - mu[:, np.newaxis])
+		s = np.sqrt(np.where(valid, deltas**2, 0).sum(axis=1) / counts)
+		# (plus a hair, so identical estimates don't drop each other)
+		keep = valid & (deltas <= deviations * s[:, np.newaxis] + 1e-9)
+		kept = keep.sum(axis=1)
+		sums = np.where(keep, freqs, 0).sum(axis=1)
+		return np.where(kept > 0, sums / np.maximum(kept, 1), 0.0)
 
 	def getAmplitude(self, block):
 		"""Get the RMS (root-mean-square) amplitude of a block."""
 		# CITE https://en.wikipedia.org/wiki/Root_mean_square
-		count = len(block) / 2
-		format = "%dh" % (count)
-		wavBlock = struct.unpack(format, block)
+		return BlockFeatures(block, self.rate).amplitude / 1000
+
+	def processAudio(self, block):
+		"""Run pitch detection on a block, or on each frame the block
+		completes if useFrames() is on. Blocks holding several frames' 
+		worth of audio (e.g. from catchUp()) are detected in one batch."""
+		self.pitches = []
+		self.onsets = np.zeros(0, dtype=bool)
+		self.times = np.zeros(0)
+		if ( not block ): 
+			return # nothing read
+		samples = np.frombuffer(block, dtype=np.int16)
+		# The block was the last thing read, so it ends at the source's clock
+		blockStart = self.clock * self.rate - len(samples)
+		if ( self.framer is None ):
+			count = len(samples) / self.framesPerBuffer
+			if ( count > 1 ):
+				size = self.framesPerBuffer
+				self.processFrames(samples[:count*size].reshape(count, size))
+				starts = blockStart + np.arange(count) * size
+			else:
+				self.processFrame(block)
+				self.pitches.append(self.pitch)
+				starts = np.array([blockStart])
+		else:
+			self.framer.push(samples)
+			frames = list(self.framer.frames())
+			if ( len(frames) > 1 ):
+				self.processFrames(np.array(frames))
+			elif ( len(frames) == 1 ):
+				self.processFrame(frames[0])
+				self.pitches.append(self.pitch)
+			else:
+				# Still filling the first window: nothing heard yet
+				self.pitch = None
+				self.detectedNoise = False
+			# Frame positions are counted from the first sample pushed
+			offset = blockStart + len(samples) - self.framer.ring.written
+			hop = self.framer.hopSize
+			starts = (offset + self.framer.nextStart - 
+					  hop * np.arange(len(frames), 0, -1))
+			# Stamp each frame at its middle hop (see the class docstring)
+			starts += (self.framer.windowSize - hop) / 2
+		self.times = starts / float(self.rate)
 
-		sumOfSquares = 0.0
-		for sample in wavBlock:
-			# normalize
-			n = sample / float(self.rate)
-			sumOfSquares += n*n
+	def detectFrames(self, frames):
+		"""Batched pitch detection for a frames x samples array. Returns an
+		array of frequencies (0 = no pitch) and an array of confidences. 
+		Frames the noise gate closes on never reach the estimator (or the
+		FFT). Sets self.onsets for the frames."""
+		frames = np.asarray(frames)
+		freqs = np.zeros(len(frames))
+		confidences = np.zeros(len(frames))
+		if ( len(frames) == 0 ):
+			self.onsets = np.zeros(0, dtype=bool)
+			return freqs, confidences
+		self.checkRange(frames.shape[1])
+		# Same scale as BlockFeatures.amplitude
+		rms = np.sqrt((frames.astype(np.float64)**2).mean(axis=1))
+		amplitudes = rms / self.rate * 1000
+		isOpen = np.array([self.gate.isOpen(a) for a in amplitudes])
+		if ( isOpen.all() ):
+			self.onsets = self.onsetDetector.update(BlockFeatures.spectra(frames))
+		else:
+			# Onsets in order, gated runs as silence
+			self.onsets = np.zeros(len(frames), dtype=bool)
+			edges = np.flatnonzero(np.diff(isOpen)) + 1
+			for run in np.split(np.arange(len(frames)), edges):
+				if ( isOpen[run[0]] ):
+					self.onsets[run] = self.onsetDetector.update(
+										BlockFeatures.spectra(frames[run]))
+				else:
+					self.onsets[run] = self.onsetDetector.silence(len(run))
+		if ( isOpen.any() ):
+			freqs[isOpen], confidences[isOpen] = \
+				self.estimator.estimateBatch(frames[isOpen])
+		return freqs, confidences
 
-		return sqrt(sumOfSquares/count)
-	
+	def processFrames(self, frames):
+		"""processFrame() for a batch of frames."""
+		freqs, confidences = self.detectFrames(frames)
+		self.pitches = [Pitch(freq) if freq > 0 else None for freq in freqs]
+		self.pitch = self.pitches[-1]
+		self.confidence = confidences[-1]
+		self.detectedNoise = self.pitch is not None
+		self.features = BlockFeatures(frames[-1], self.rate)
 
-	def processAudio(self, block):
+	def catchUp(self):
+		"""After a stall, take everything waiting in the capture queue (see
+		QueuedSource) and detect it in one batch, smoothed the way
+		smoothedPitch() would have. Returns how many estimates that made
+		(0 if there was no backlog); they're in self.pitches, with
+		self.smoothed, self.times and self.onsets to match."""
+		if ( self.backlog == 0 ):
+			return 0
+		waiting = self.backlog * self.source.blockFrames
+		frames = waiting / self.framesPerBuffer * self.framesPerBuffer
+		if ( frames <= self.framesPerBuffer ):
+			return 0
+		self.processAudio(self.source.read(frames))
+		self.smoothPitches()
+		return len(self.pitches)
+
+	def processFrame(self, block):
 		try: 
-			samples = fromstring(block, dtype=int16)
-			freq = analyse.detect_pitch(samples) 
-			amplitude = self.getAmplitude(block) * 1000
+			self.features = BlockFeatures(block, self.rate)
+			self.checkRange(len(self.features.samples))
+			if ( not self.gate.isOpen(self.features.amplitude) ):
+				# Too quiet to bother detecting a pitch (or onset)
+				self.onsets = self.onsetDetector.silence()
+				self.detectedNoise = False
+				self.pitch = None
+				self.confidence = 0.0
+				return
+			self.onsets = self.onsetDetector.update(
+								self.features.spectrum[np.newaxis])
+			freq, self.confidence = self.estimator.estimate(self.features.samples)
 			self.detectedNoise = type(freq) != type(None)		
-			if ( self.detectedNoise and amplitude >= self.amplitudeThreshold):
+			if ( self.detectedNoise ):
 				self.pitch = Pitch(freq)
 			else:
 				self.pitch = None	
@@ -0,0 +1,88 @@
+import numpy as np
+
+class RingBuffer(object):
+	"""A fixed-size ring buffer of audio samples backed by a NumPy array.
+
+	Every sample is stored twice, capacity samples apart, so any run of up
+	to capacity recent samples is one contiguous slice of the array. That
+	means view() can hand out plain NumPy views (no copying, no wrapping
+	around) that pitch detection can use directly.
+
+	Samples are addressed by their absolute position in the stream, i.e.
+	how many samples had been written before them.
+
+	Example:
+	ring = RingBuffer(8192)
+	ring.write(samples)
+	frame = ring.view(ring.written - 2048, 2048) # last 2048 samples
+	"""
+	def __init__(self, capacity, dtype=np.int16):
+		self.capacity = capacity
+		self.data = np.zeros(2 * capacity, dtype=dtype)
+		self.written = 0 # total samples ever written
+
+	@property
+	def oldest(self):
+		"""Absolute position of the oldest sample still in the buffer."""
+		return max(0, self.written - self.capacity)
+
+	def write(self, samples):
+		"""Append samples, overwriting the oldest ones if need be."""
+		if ( len(samples) > self.capacity ):
+			self.written += len(samples) - self.capacity
+			samples = samples[-self.capacity:]
+		count = len(samples)
+		start = self.written % self.capacity
+		firstPart = min(count, self.capacity - start)
+		for offset in (0, self.capacity):
+			# Write once in each half of the array
+			self.data[offset+start:offset+start+firstPart] = samples[:firstPart]
+			self.data[offset:offset+count-firstPart] = samples[firstPart:]
+		self.written += count
+
+	def view(self, start, length):
+		"""A view of length samples starting at absolute position start.
+		Only valid until the next write() that overwrites it."""
+		if ( start < self.oldest or start + length > self.written ):
+			raise IndexError("Samples %d-%d aren't in the buffer." %
+							 (start, start + length))
+		index = start % self.capacity
+		return self.data[index:index+length]
+
+
+class Framer(object):
+	"""Cuts a stream of samples into overlapping analysis frames.
+
+	Frames are windowSize samples long and start every hopSize samples, so
+	a long window (good for low notes) can still produce an estimate every
+	hop. frames() yields views into the ring buffer, not copies; use each
+	frame before the next push().
+
+	If the reader falls more than a buffer behind, the frames it missed are
+	skipped and counted in framesDropped.
+
+	Example:
+	framer = Framer(windowSize=4096, hopSize=512)
+	framer.push(samples)
+	for frame in framer.frames(): detect(frame)
+	"""
+	def __init__(self, windowSize=2048, hopSize=512, capacity=None):
+		self.windowSize = windowSize
+		self.hopSize = hopSize
+		self.ring = RingBuffer(capacity or 4 * max(windowSize, hopSize))
+		self.nextStart = 0 # absolute position of the next frame
+		self.framesDropped = 0
+
+	def push(self, samples):
+		self.ring.write(samples)
+
+	def frames(self):
+		"""Yield every complete frame that hasn't been yielded yet."""
+		if ( self.nextStart < self.ring.oldest ):
+			missed = self.ring.oldest - self.nextStart
+			hops = -(-missed // self.hopSize) # round up
+			self.framesDropped += hops
+			self.nextStart += hops * self.hopSize
+		while ( self.nextStart + self.windowSize <= self.ring.written ):
+			yield self.ring.view(self.nextStart, self.windowSize)
+			self.nextStart += self.hopSize
@@ -0,0 +1,95 @@
+from music21 import stream, tempo
+from music21.musicxml import m21ToXml
+import xml.etree.ElementTree as ElementTree
+import os, time, copy
+
+class ScoreWriter(object):
+	"""Writes a transcription to a MusicXML file a measure at a time, as
+	each one is finished, so a long session never has to hold (or
+	serialize) the whole score at once; once written, a measure can be
+	let go of.
+
+	The file is a complete MusicXML document after every write(): each
+	measure goes in just before the closing tags, which are then written
+	again after it. It's flushed every time and synced to disk every
+	checkpointSeconds, so after a crash the file holds everything up to
+	the last checkpoint (run recover() on it if it was cut off mid-write).
+
+	Example:
+	writer = ScoreWriter("session.xml", bpm=90)
+	for measure in measures:
+		writer.write(measure)
+	writer.close()
+	"""
+	header = ('<?xml version="1.0" encoding="utf-8"?>\n'
+			  '<!DOCTYPE score-partwise PUBLIC '
+			  '"-//Recordare//DTD MusicXML 3.0 Partwise//EN" '
+			  '"http://www.musicxml.org/dtds/partwise.dtd">\n'
+			  '<score-partwise version="3.0">\n'
+			  '<part-list><score-part id="P1"><part-name>%s</part-name>'
+			  '</score-part></part-list>\n'
+			  '<part id="P1">\n')
+	trailer = '</part>\n</score-partwise>\n'
+
+	def __init__(self, path, bpm=None, name="Transcription",
+				 checkpointSeconds=30.0):
+		self.path = path
+		self.bpm = bpm # written as a metronome mark in the first measure
+		self.checkpointSeconds = checkpointSeconds
+		self.measureCount = 0
+		self.file = open(path, "wb")
+		self.file.write(self.header % name + self.trailer)
+		self.checkpoint()
+
+	def write(self, measure):
+		"""Append a finished music21.stream.Measure() to the file."""
+		measure = copy.deepcopy(measure) # so the caller's stays untouched
+		if ( self.measureCount == 0 and self.bpm is not None ):
+			measure.insert(0, tempo.MetronomeMark(number=self.bpm))
+		xml = self.measureXml(measure)
+		self.file.seek(-len(self.trailer), os.SEEK_END)
+		self.file.write(xml + "\n" + self.trailer)
+		self.file.flush()
+		self.measureCount += 1
+		if ( time.time() - self.lastCheckpoint >= self.checkpointSeconds ):
+			self.checkpoint()
+
+	@classmethod
+	def measureXml(_class, measure):
+		"""One measure as a MusicXML <measure> element (as a string)."""
+		part = stream.Part()
+		part.append(measure)
+		element = m21ToXml.PartExporter(part).parse()
+		return ElementTree.tostring(element.find("measure"))
+
+	def checkpoint(self):
+		"""Make sure everything written so far is on disk."""
+		self.file.flush()
+		os.fsync(self.file.fileno())
+		self.lastCheckpoint = time.time()
+
+	def close(self):
+		if ( not self.file.closed ):
+			self.checkpoint()
+			self.file.close()
+
+	@classmethod
+	def recover(_class, path):
+		"""Repair a file a crash cut off mid-measure: drop the partial
+		measure and close the document again. Returns how many measures
+		it holds."""
+		with open(path, "r+b") as scoreFile:
+			contents = scoreFile.read()
+			if ( not contents.endswith(_class.trailer) ):
+				start = contents.find('<part id="P1">')
+				if ( start < 0 ):
+					raise ValueError("%s wasn't written by a ScoreWriter." % path)
+				end = contents.rfind("</measure>")
+				if ( end >= 0 ):
+					end += len("</measure>")
+				else:
+					end = start + len('<part id="P1">')
+				scoreFile.seek(end)
+				scoreFile.truncate()
+				scoreFile.write("\n" + _class.trailer)
+		return contents.count("</measure>")
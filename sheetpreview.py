@@ -0,0 +1,181 @@
+from music21 import clef
+import Image, ImageDraw
+
+class PreviewEngraver(object):
+	"""Draws a system of measures straight from the music21 objects with
+	PIL, in a few milliseconds: a staff, clefs, time signatures, note
+	heads with stems, flags, dots, ledger lines and accidentals, rests,
+	and barlines. Nowhere near engraving quality, but good enough to
+	follow along while recording; lilypond is kept for export.
+
+	Everything is sized from staffSpace, the gap between staff lines in
+	pixels. Notes are spaced by time (quarterSpaces staff spaces to a
+	quarter note), not by how much room they need.
+
+	Example:
+	engraver = PreviewEngraver(staffSpace=8)
+	image = engraver.engrave(measures)
+	"""
+	name = "preview"
+	ink = (0, 0, 0)
+	paper = (255, 255, 255)
+	flags = {"eighth": 1, "16th": 2, "32nd": 3, "64th": 4}
+	hollow = ("half", "whole", "breve")
+
+	def __init__(self, staffSpace=8, quarterSpaces=6):
+		self.space = staffSpace
+		self.quarterWidth = quarterSpaces * staffSpace
+		self.top = 5 * staffSpace # room above the staff for stems and ledgers
+		self.height = 14 * staffSpace
+
+	def engrave(self, measures, timeSignature=None):
+		"""Draw measures as one system. timeSignature is the meter in force
+		before the first measure (if it doesn't have one itself)."""
+		s = self.space
+		meters = []
+		for measure in measures:
+			if ( measure.timeSignature is not None ):
+				timeSignature = measure.timeSignature
+			meters.append(timeSignature)
+		widths = [self.measureWidth(measure, meter)
+				  for (measure, meter) in zip(measures, meters)]
+		width = 2*s + sum(widths) + 6*s * len(measures) # room for clefs etc.
+		image = Image.new("RGB", (width, self.height), self.paper)
+		draw = ImageDraw.Draw(image)
+
+		x = s
+		current = None
+		for (i, measure) in enumerate(measures):
+			if ( i == 0 and measure.number ):
+				draw.text((x, self.top - 4*s), str(measure.number), fill=self.ink)
+			measureClef = measure.clef or current or clef.TrebleClef()
+			if ( i == 0 or measureClef.sign != current.sign ):
+				x = self.drawClef(draw, x, measureClef)
+			current = measureClef
+			if ( measure.timeSignature is not None ):
+				x = self.drawTimeSignature(draw, x, measure.timeSignature)
+			left = x + s
+			for element in measure.notesAndRests:
+				self.drawElement(draw, left, element, current.lowestLine)
+			x = left + widths[i]
+			draw.line((x, self.top, x, self.top + 4*s), fill=self.ink)
+
+		for line in xrange(5):
+			y = self.top + line*s
+			draw.line((0, y, x, y), fill=self.ink)
+		return image.crop((0, 0, x + 1, self.height))
+
+	def measureWidth(self, measure, timeSignature):
+		bar = 4.0
+		if ( timeSignature is not None ):
+			bar = timeSignature.barDuration.quarterLength
+		return int(max(bar, measure.highestTime) * self.quarterWidth) + self.space
+
+	def staffY(self, step, lowestLine):
+		"""y of a diatonic step (music21 diatonicNoteNum) on the staff."""
+		return self.top + 4*self.space - (step - lowestLine) * self.space / 2.0
+
+	def drawClef(self, draw, x, staffClef):
+		s = self.space
+		if ( staffClef.sign == "F" ):
+			y = self.staffY(staffClef.lowestLine + 6, staffClef.lowestLine) # F line
+			draw.ellipse((x, y - s/2, x + s, y + s/2), fill=self.ink)
+			draw.arc((x - s, y - s, x + 2*s, y + 3*s), 270, 90, fill=self.ink)
+			for dy in (-s/2, s/2):
+				draw.ellipse((x + 2.4*s, y + dy - 2, x + 2.4*s + 4, y + dy + 2),
+							 fill=self.ink)
+		else:
+			y = self.staffY(staffClef.lowestLine + 2, staffClef.lowestLine) # G line
+			draw.line((x + s, self.top - s, x + s, self.top + 5*s),
+					  fill=self.ink, width=2)
+			draw.ellipse((x, y - s, x + 2*s, y + s), outline=self.ink)
+			draw.ellipse((x + s/2, self.top + 5*s - s/2, x + 3*s/2,
+						  self.top + 5*s + s/2), fill=self.ink)
+		return x + 3*s
+
+	def drawTimeSignature(self, draw, x, timeSignature):
+		s = self.space
+		draw.text((x, self.top + s/2), str(timeSignature.numerator),
+				  fill=self.ink)
+		draw.text((x, self.top + 2*s + s/2), str(timeSignature.denominator),
+				  fill=self.ink)
+		return x + 2*s
+
+	def drawElement(self, draw, left, element, lowestLine):
+		"""Draw a note or rest, split into the durations it's written as
+		(tied, for notes)."""
+		offset = element.offset
+		previous = None
+		for component in element.duration.components:
+			x = left + offset * self.quarterWidth
+			if ( element.isRest ):
+				self.drawRest(draw, x, component, lowestLine)
+			else:
+				y = self.drawNote(draw, x, element.pitch, component, lowestLine,
+								  accidental=previous is None)
+				if ( previous is not None ):
+					draw.arc((previous + self.space, y, x, y + self.space),
+							 0, 180, fill=self.ink)
+				previous = x
+			offset += component.quarterLength
+
+	def drawNote(self, draw, x, pitch, component, lowestLine, accidental=True):
+		s = self.space
+		step = pitch.diatonicNoteNum
+		y = self.staffY(step, lowestLine)
+		# Ledger lines
+		for ledger in range(lowestLine - 2, step - 1, -2) + \
+					  range(lowestLine + 10, step + 1, 2):
+			ly = self.staffY(ledger, lowestLine)
+			draw.line((x - s/2, ly, x + 2*s, ly), fill=self.ink)
+		# Head
+		head = (x, y - s/2, x + 1.3*s, y + s/2)
+		if ( component.type in self.hollow ):
+			draw.ellipse(head, outline=self.ink)
+		else:
+			draw.ellipse(head, fill=self.ink)
+		if ( accidental and pitch.accidental is not None ):
+			symbol = {"sharp": "#", "flat": "b"}.get(pitch.accidental.name)
+			if ( symbol ):
+				draw.text((x - s, y - s), symbol, fill=self.ink)
+		# Stem and flags
+		if ( component.type not in ("whole", "breve") ):
+			up = step < lowestLine + 4 # below the middle line
+			stemX = x + 1.3*s if up else x
+			tip = y - 3.5*s if up else y + 3.5*s
+			draw.line((stemX, y, stemX, tip), fill=self.ink)
+			direction = 1 if up else -1
+			for flag in xrange(self.flags.get(component.type, 0)):
+				fy = tip + direction * flag * 0.8*s
+				draw.line((stemX, fy, stemX + s, fy + direction * 1.5*s),
+						  fill=self.ink)
+		self.drawDots(draw, x, y, component.dots, onLine=(step - lowestLine) % 2 == 0)
+		return y
+
+	def drawRest(self, draw, x, component, lowestLine):
+		s = self.space
+		middle = self.staffY(lowestLine + 4, lowestLine)
+		if ( component.type in ("whole", "breve") ):
+			y = self.staffY(lowestLine + 6, lowestLine) # hangs from line 4
+			draw.rectangle((x, y, x + 1.2*s, y + s/2), fill=self.ink)
+		elif ( component.type == "half" ):
+			draw.rectangle((x, middle - s/2, x + 1.2*s, middle), fill=self.ink)
+		elif ( component.type == "quarter" ):
+			draw.line([(x + 0.3*s, middle - 1.5*s), (x + s, middle - 0.6*s),
+					   (x + 0.3*s, middle + 0.2*s), (x + s, middle + s),
+					   (x + 0.3*s, middle + 1.5*s)], fill=self.ink, width=2)
+		else:
+			draw.line((x + s, middle - s, x + 0.4*s, middle + 1.5*s),
+					  fill=self.ink)
+			for flag in xrange(self.flags.get(component.type, 1)):
+				fy = middle - s + flag * 0.8*s
+				draw.ellipse((x, fy - 2, x + 4, fy + 2), fill=self.ink)
+		self.drawDots(draw, x, middle, component.dots, onLine=True)
+
+	def drawDots(self, draw, x, y, dots, onLine=False):
+		s = self.space
+		if ( onLine ):
+			y -= s/2 # dots sit in a space
+		for dot in xrange(dots):
+			dx = x + 1.8*s + dot * 0.6*s
+			draw.ellipse((dx, y - 1.5, dx + 3, y + 1.5), fill=self.ink)
@@ -0,0 +1,279 @@
+from music21 import stream
+from sheetpreview import *
+from threading import Thread
+import Image, ImageChops
+import Queue, copy, hashlib, os
+
+class RenderCache(object):
+	"""Rendered systems kept on disk as PNGs, named by a hash of what's in
+	them, so anything already engraved (this session or an earlier one)
+	never goes through lilypond again.
+
+	The cache holds at most maxBytes; past that, the least recently used
+	images are deleted. Use is tracked by file modification time, which
+	get() bumps, so it carries over between runs too.
+
+	Example:
+	cache = RenderCache(maxBytes=16*2**20)
+	image = cache.get(key)
+	if ( image is None ):
+		cache.put(key, render())
+	"""
+	def __init__(self, directory=None, maxBytes=64*2**20):
+		if ( directory is None ):
+			directory = os.path.join(os.path.expanduser("~"),
+									 ".music-transcription", "render-cache")
+		self.directory = directory
+		self.maxBytes = maxBytes
+		self.hits = self.misses = 0
+		if ( not os.path.isdir(directory) ):
+			os.makedirs(directory)
+
+	def path(self, key):
+		return os.path.join(self.directory, key + ".png")
+
+	def get(self, key):
+		"""The image stored under key, or None."""
+		path = self.path(key)
+		try:
+			image = Image.open(path)
+			image.load() # read it now, before eviction can delete it
+			os.utime(path, None) # most recently used
+		except (IOError, OSError):
+			self.misses += 1
+			return None
+		self.hits += 1
+		return image
+
+	def put(self, key, image):
+		path = self.path(key)
+		temporary = "%s.%d.tmp" % (path, os.getpid())
+		image.save(temporary, "PNG")
+		os.rename(temporary, path) # never leave a half-written image
+		self.evict()
+
+	def evict(self):
+		"""Delete least recently used images until under maxBytes."""
+		entries = []
+		for name in os.listdir(self.directory):
+			if ( not name.endswith(".png") ):
+				continue
+			try:
+				info = os.stat(os.path.join(self.directory, name))
+			except OSError:
+				continue # someone else evicted it
+			entries.append((info.st_mtime, info.st_size, name))
+		total = sum([size for (mtime, size, name) in entries])
+		for (mtime, size, name) in sorted(entries):
+			if ( total <= self.maxBytes ):
+				break
+			try:
+				os.remove(os.path.join(self.directory, name))
+			except OSError:
+				pass
+			total -= size
+
+
+class LilypondEngraver(object):
+	"""Engraves a system of measures properly, through music21 and
+	lilypond. Takes a second or more, so it's best used with a
+	RenderCache.
+
+	Example:
+	renderer = SheetRenderer(engraver=LilypondEngraver(), cache=RenderCache())
+	"""
+	name = "lilypond"
+
+	def engrave(self, measures, timeSignature=None):
+		"""Engrave one system, trimmed to what lilypond drew."""
+		part = stream.Part()
+		for measure in measures:
+			part.append(copy.deepcopy(measure))
+		first = part.getElementsByClass("Measure")[0]
+		if ( first.timeSignature is None and timeSignature is not None ):
+			# Carry the meter over, or lilypond assumes 4/4
+			first.insert(0, copy.deepcopy(timeSignature))
+		return self.trim(Image.open(part.write("lily.png")))
+
+	@classmethod
+	def trim(_class, image, margin=10):
+		"""Crop the blank page around what lilypond drew."""
+		image = image.convert("RGB")
+		blank = Image.new("RGB", image.size, (255, 255, 255))
+		box = ImageChops.difference(image, blank).getbbox()
+		if ( box is None ):
+			return image
+		(left, top, right, bottom) = box
+		return image.crop((max(0, left - margin), max(0, top - margin),
+						   min(image.size[0], right + margin),
+						   min(image.size[1], bottom + margin)))
+
+
+class SheetRenderer(Thread):
+	"""Renders the transcribed score to an image on a worker thread, so
+	lilypond never holds up recording or the Tk main loop.
+
+	The renderer keeps its own copy of the score: reset() and append()
+	queue changes to it, and the worker applies every change waiting
+	before it renders, so a burst of measures costs one render of the
+	newest score instead of one each. Finished images (PIL, already
+	scaled) go into self.results; turning them into an ImageTk.PhotoImage
+	is left to the Tk main thread.
+
+	The score is engraved a system (measuresPerSystem measures) at a time
+	and the systems stacked into one image. Each system is looked up by a
+	hash of its contents, first among the last render's systems and then
+	in the RenderCache on disk if there is one, so as measures come in
+	only the last system is engraved again, and render time stays flat
+	however long the score gets.
+
+	With maxSystems set, only the last maxSystems systems are kept and
+	shown, so memory stays bounded in long sessions.
+
+	The engraver does the drawing: a PreviewEngraver (the default, and
+	fast enough not to need a cache) or a LilypondEngraver.
+
+	If a render fails (e.g. lilypond isn't installed), the exception is
+	kept in self.error and the worker carries on with the next request.
+
+	Example:
+	renderer = SheetRenderer()
+	renderer.start()
+	renderer.append(measures)
+	image = renderer.results.get()
+	"""
+	def __init__(self, scale=1.0, measuresPerSystem=4, engraver=None, 
+				 cache=None, maxSystems=None):
+		Thread.__init__(self)
+		self.daemon = True
+		self.scale = scale
+		self.measuresPerSystem = measuresPerSystem
+		self.engraver = engraver or PreviewEngraver()
+		self.cache = cache # a RenderCache, or None
+		self.maxSystems = maxSystems
+		self.requests = Queue.Queue()
+		self.results = Queue.Queue()
+		self.measures = []
+		self.timeSignature = None # meter in force before self.measures
+		self.systems = {} # hash: image, for the systems last rendered
+		self.renderCount = 0
+		self.engraveCount = 0 # systems that had to be engraved
+		self.error = None
+
+	def reset(self, measures):
+		"""Start the score over with measures."""
+		self.requests.put(("reset", self.freeze(measures)))
+
+	def append(self, measures):
+		"""Add measures to the end of the score."""
+		self.requests.put(("append", self.freeze(measures)))
+
+	def refresh(self):
+		"""Render the score again, changed or not."""
+		self.requests.put(("refresh", []))
+
+	def stop(self):
+		self.requests.put(None)
+
+	@classmethod
+	def freeze(_class, measures):
+		# The caller keeps using its measures, so the worker gets copies
+		return [copy.deepcopy(measure) for measure in measures]
+
+	def run(self):
+		"""Implementation of threading.Thread() run function, which is the
+		thread's main loop."""
+		while True:
+			request = self.requests.get()
+			# Coalesce: take in everything that's waiting, render once
+			while ( request is not None ):
+				self.apply(request)
+				try:
+					request = self.requests.get_nowait()
+				except Queue.Empty:
+					break
+			if ( request is None ):
+				return # stopped
+			image = self.render()
+			if ( image is not None ):
+				self.results.put(image)
+
+	def apply(self, request):
+		(kind, measures) = request
+		if ( kind == "reset" ):
+			self.measures = []
+			self.timeSignature = None
+		self.measures.extend(measures)
+		if ( self.maxSystems is not None ):
+			# Drop whole systems, so the rest keep their line breaks
+			size = self.measuresPerSystem
+			systems = (len(self.measures) + size - 1) / size
+			drop = max(0, systems - self.maxSystems) * size
+			for measure in self.measures[:drop]:
+				if ( measure.timeSignature is not None ):
+					self.timeSignature = measure.timeSignature # still in force
+			del self.measures[:drop]
+
+	def render(self):
+		"""Render the whole score, reusing every system that's unchanged."""
+		try:
+			images = []
+			systems = {}
+			timeSignature = self.timeSignature
+			size = self.measuresPerSystem
+			for start in xrange(0, len(self.measures), size):
+				measures = self.measures[start:start+size]
+				key = self.systemKey(measures, timeSignature)
+				image = self.systems.get(key)
+				if ( image is None and self.cache is not None ):
+					image = self.cache.get(key)
+				if ( image is None ):
+					image = self.engrave(measures, timeSignature)
+					if ( self.cache is not None ):
+						self.cache.put(key, image)
+				systems[key] = image
+				images.append(image)
+				for measure in measures:
+					if ( measure.timeSignature is not None ):
+						timeSignature = measure.timeSignature
+			self.systems = systems
+			image = self.stitch(images)
+		except Exception, error:
+			self.error = error
+			return None
+		self.renderCount += 1
+		return image
+
+	def systemKey(self, measures, timeSignature):
+		"""Hash of everything that shows in a system's image."""
+		contents = [self.engraver.name, self.scale,
+					getattr(timeSignature, "ratioString", None)]
+		for measure in measures:
+			contents.append((measure.number,
+							 getattr(measure.timeSignature, "ratioString", None)))
+			for element in measure.notesAndRests:
+				pitch = getattr(element, "nameWithOctave", None)
+				contents.append((element.classes[0], float(element.offset),
+								 float(element.quarterLength), pitch))
+		return hashlib.sha1(repr(contents)).hexdigest()
+
+	def engrave(self, measures, timeSignature=None):
+		"""Engrave one system and scale it for display."""
+		image = self.engraver.engrave(measures, timeSignature)
+		self.engraveCount += 1
+		if ( self.scale == 1.0 ):
+			return image
+		size = tuple([int(round(dim*self.scale)) for dim in image.size])
+		return image.resize(size, Image.ANTIALIAS)
+
+	@classmethod
+	def stitch(_class, images):
+		"""Stack systems top to bottom into one image."""
+		width = max([image.size[0] for image in images] or [1])
+		height = sum([image.size[1] for image in images]) or 1
+		sheet = Image.new("RGB", (width, height), (255, 255, 255))
+		top = 0
+		for image in images:
+			sheet.paste(image, (0, top))
+			top += image.size[1]
+		return sheet
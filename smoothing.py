@@ -0,0 +1,108 @@
+from collections import deque
+from bisect import insort, bisect_left, bisect_right
+
+class PitchSmoother(object):
+	"""A streaming moving average of pitch estimates with outliers removed.
+
+	Keeps a sliding window over the last windowLength estimates and gives
+	back a smoothed frequency after every one, so consecutive windows
+	overlap and nothing has to be re-read. The window's sums and sorted
+	order are updated as estimates come and go, so the mean, the spread
+	and which estimates are outliers come from a couple of binary
+	searches. Each update still costs O(windowLength) (inserting into the
+	sorted window; with outliers, summing what's left; with "mad", sorting
+	the deviations), which is fine for the 3-5 estimate windows
+	PitchDetect uses. Don't use it for long windows.
+
+	Outlier rejection:
+		"sigma": drop estimates more than deviations standard deviations
+			from the mean (what averagePitch() always did)
+		"mad": drop estimates more than deviations median absolute
+			deviations from the median; sturdier against octave jumps
+		None: plain moving average
+
+	An estimate of None or 0 means "no pitch". The smoothed pitch is None
+	unless at least minVoiced of the window's estimates had a pitch (by
+	default, half of them).
+
+	Example:
+	smoother = PitchSmoother(windowLength=5, rejection="mad")
+	for freq in estimates:
+		print smoother.update(freq)
+	"""
+	rejections = ("sigma", "mad", None)
+
+	def __init__(self, windowLength=3, rejection="sigma", deviations=2.0,
+				 minVoiced=None):
+		if ( rejection not in self.rejections ):
+			raise ValueError("Unknown outlier rejection: %r" % rejection)
+		self.rejection = rejection
+		self.deviations = deviations
+		self.minVoiced = minVoiced
+		self.resize(windowLength)
+
+	def resize(self, windowLength):
+		"""Change the window length (this starts a fresh window)."""
+		self.windowLength = windowLength
+		self.reset()
+
+	def reset(self):
+		self.window = deque() # every estimate, 0 for no pitch
+		self.voiced = [] # the ones with a pitch, kept sorted
+		self.total = 0.0
+		self.totalSquares = 0.0
+		self.freq = None
+
+	def update(self, freq):
+		"""Add an estimate (in Hz, or None/0) and return the smoothed
+		frequency, or None if there's no clear pitch."""
+		freq = float(freq or 0.0)
+		self.window.append(freq)
+		if ( freq > 0 ):
+			insort(self.voiced, freq)
+			self.total += freq
+			self.totalSquares += freq * freq
+		if ( len(self.window) > self.windowLength ):
+			old = self.window.popleft()
+			if ( old > 0 ):
+				del self.voiced[bisect_left(self.voiced, old)]
+				self.total -= old
+				self.totalSquares -= old * old
+				if ( len(self.voiced) == 0 ):
+					self.total = self.totalSquares = 0.0 # shed rounding error
+		self.freq = self.estimate()
+		return self.freq
+
+	def estimate(self):
+		count = len(self.voiced)
+		minVoiced = self.minVoiced or max(1, (self.windowLength + 1) / 2)
+		if ( count < minVoiced ):
+			return None
+		mean = self.total / count
+		if ( self.rejection is None or count < 3 ):
+			return mean
+
+		if ( self.rejection == "sigma" ):
+			center = mean
+			variance = max(0.0, self.totalSquares / count - mean * mean)
+			spread = variance ** 0.5
+		else:
+			center = self.median(self.voiced)
+			spread = self.median(sorted([abs(f - center) for f in self.voiced]))
+		# (plus a hair, so identical estimates don't drop each other)
+		limit = self.deviations * spread + 1e-9
+		# The window's sorted, so what's kept is one run of it
+		first = bisect_left(self.voiced, center - limit)
+		last = bisect_right(self.voiced, center + limit)
+		if ( first == 0 and last == count ):
+			return mean # no outliers: the running total will do
+		if ( last <= first ):
+			return center
+		return sum(self.voiced[first:last]) / (last - first)
+
+	@classmethod
+	def median(_class, ordered):
+		middle = len(ordered) / 2
+		if ( len(ordered) % 2 ):
+			return ordered[middle]
+		return (ordered[middle - 1] + ordered[middle]) / 2.0
@@ -5,7 +5,10 @@ import tkMessageBox
 class Tuner(RetainedAnimation):
 	## Audio functions: grabs and processes audio data for use. ##
 	def initAudio(self):
-		self.listener = PitchDetect(channels=1)
+		# Capture into a small queue, so a slow redraw drops old audio
+		# rather than overflowing the input stream
+		self.listener = PitchDetect(channels=1, queueSize=8, 
+									policy="drop-oldest")
 
 	## GUI functions: create buttons and dialogs. ##
 	def initGUI(self):
@@ -159,7 +162,7 @@ Tuning precision: %0.1f Hz""" % (micName, self.tuningPrecision)
 	## Controller functions. ##
 	def timerFired(self):
 		#self.listener.listen() # New info from microphone - raw
-		self.listener.averagePitch() # New info from microphone - moving avg
+		self.listener.smoothedPitch() # New info from microphone - moving avg
 		if ( self.listener.detectedPitch ):
 			self.updateInfo()
 			self.updateIndicator()
@@ -1,64 +1,38 @@
 # Graphics
 from Tkinter import *
-from bettertimer import *
 import ImageTk, Image
 import tkFileDialog, tkMessageBox
 
 # Audio
 from music21 import note, stream, pitch, clef, tempo 
 from pitchdetect import *
+from measurebuilder import *
+from pipeline import *
+from detectprocess import *
+from sheetrenderer import *
+from scorewriter import *
+from midiwriter import *
+import exporter
 
 # Misc
-import time
-from itertools import groupby
-from threading import Thread
-
-class Util(object):
-	@classmethod
-	def chunks(_class, l, n):
-		# CITE: http://stackoverflow.com/questions/312443/how-do-you-split-a-list-into-evenly-sized-chunks-in-python
-	    """ Yield successive n-sized chunks from l.
-	    """
-	    for i in xrange(0, len(l), n):
-	        yield l[i:i+n]
-	@classmethod
-	def counter(_class, l):
-		# CITE: http://docs.python.org/2/library/itertools.html#itertools.groupby
-		"""
-		Counts the number of occurrences ofn note elements in a list.
-
-		Equivalent to collections.Counter, except it compensates for
-		the broken hash representation of music21.note.Note() classes.
-		"""
-		occurrences = {}
-		# Quick explanation:
-		# >>> c4_1, c4_2 = note.Note("C4"), c4_2 = note.Note("C4")
-		# >>> hash(c4_1) == hash(c4_2) # False (why, I have no idea)
-		# >>> hash(c4_1.fullName) == hash(c4_2.fullName) # True
-
-		fixedList = [ "n_"+elem.nameWithOctave if isinstance(elem, note.Note) 
-					  else None 
-					  for elem in l ]  
-
-		for elem in set(fixedList):
-			if ( type(elem) == str and elem[0:2] == "n_" ):
-				occurrences[note.Note(elem[2:])] = fixedList.count(elem)
-			else:
-				occurrences[elem] = l.count(elem)
-		return occurrences		
-		
-	@classmethod
-	def stepround(_class, n, step):
-		return int( step*round(float(n)/step) )
-		
-	def test(_class):
-		assert ( list(_class.chunks(range(10), 5)) == [[0, 1, 2, 3, 4], [5, 6, 7, 8, 9]] )
-		assert ( list(_class.chunks(range(10), 10)) == [[range(10)]] )
-		assert ( list(_class.chunks([], -2) )== [] )
-
+import time, os, tempfile
+import Queue
 
 class AudioTranscription(Frame):
-	def __init__(self):
+	def __init__(self, detectorProcess=False):
+		# Export formats run in worker processes (see exporter.py), which
+		# are forked here, before Tk, PortAudio or any threads start
+		self.exporter = exporter.ScoreExporter()
+		self.exportResults = []
+		# Capture and detection can run in a process of their own, out
+		# of the way of the UI's interpreter lock (see detectprocess.py);
+		# it's forked now for the same reason
+		self.detectorProcess = detectorProcess
+		remote = None
+		if ( detectorProcess ):
+			remote = RemoteListener(channels=1, queueSize=8,
+									policy="drop-oldest")
+
 		# Initialize Tkinter
 		self.root = Tk()
 		self.root.title("Live Transcription")
@@ -67,11 +41,10 @@ class AudioTranscription(Frame):
 		# CITE: http://mail.python.org/pipermail/tkinter-discuss/2009-April/001893.html
 		self.root.createcommand('exit', self.quitIt) 
 		
-		# Initialize timer
-		self.timerFiredDelay = 1 / 1000.0 # seconds
+		# Audio runs on one worker thread (see pipeline.py); the UI only
+		# changes here on the main thread, when it checks for news.
+		self.pollDelay = 50 # milliseconds
 		self.timerRecDelay = 0.025 # seconds = 32nd note precision @ 60bpm
-		self.timer = Timer(self.timerFiredDelay, self.timerFired)		
-		self.recordingTimer = Timer(self.timerRecDelay, lambda: None)
 
 		# Initialize GUI
 		self.buttonOptions = {'padx': 10, 'pady': 10 }
@@ -79,21 +52,39 @@ class AudioTranscription(Frame):
 		self.justLaunched = True
 		self.saveDefault = "Not saved."
 		self.saveFileStr = StringVar(self.root, self.saveDefault)
-		self.initAudio()
+		# Measures are streamed to disk as they're finished; only the
+		# last few stay in memory (and on screen)
+		self.sessionDirectory = os.path.join(os.path.expanduser("~"),
+								".music-transcription", "sessions")
+		self.keepMeasures = 16
+		self.writer = None
+		# Notes are streamed to a MIDI file next to it as they're heard
+		self.midiWriter = None
+		self.midiStart = 0.0 # where in it this take began, in seconds
+		self.midiSeconds = 0.0 # the last estimate written to it
+		self.initAudio(remote)
 		self.initWidgets()
+		# The live display is a quick native preview, drawn on its own
+		# thread; lilypond only runs on export. See sheetrenderer.py
+		self.renderer = SheetRenderer(maxSystems=4)
+		self.renderer.start()
 		self.initSheetDisplay()
-		self.timer.start()
+		self.pipeline.start()
+		self.root.after(self.pollDelay, self.poll)
 		
 	def quitIt(self): 
 		"""Quit the application after clean up."""
-		if ( self.recordingTimer.isAlive() ):
-			self.recordingTimer.stop()
-			self.recordingTimer.join()
 		self.stop()
+		self.pipeline.stop()
+		if ( self.detectorProcess ):
+			self.listener.stop() # the pipeline may be waiting on it for audio
+		self.pipeline.join()
+		if ( not self.detectorProcess ):
+			self.listener.stop() # only once the pipeline can't be reading
+		self.renderer.stop()
+		self.exporter.close()
+		self.closeSession()
 		self.root.destroy()
-		if ( self.timer.isAlive() ):
-			self.timer.stop()
-			self.timer.join() 
 		import sys; sys.exit()
 
 	def getSavePath(self):
@@ -109,22 +100,27 @@ class AudioTranscription(Frame):
 			self.listener.unpause()
 			self.recording = True
 			self.paused = False
-			self.recordingTimer.stopped = False
-			self.recordingTimer.seconds = 0
 			self.recordBtn.configure({'state': DISABLED})
 			self.pauseBtn.configure({'state': NORMAL})
 			self.stopBtn.configure({'state': NORMAL})
 			
-			tempo = int(self.tempo.get())
-			quarterNoteSeconds = 60.0 / tempo 
-			self.quarterTimerTicks = quarterNoteSeconds / self.timerRecDelay
-			self.sixteenthTimerTicks = self.quarterTimerTicks / 4.0
-			self.measureTimerTicks = self.quarterTimerTicks * 4
+			self.builder = MeasureBuilder(int(self.tempo.get()), 
+										  self.timerRecDelay)
+			if ( self.writer is None ):
+				self.writer = ScoreWriter(self.sessionPath(), 
+										  bpm=int(self.tempo.get()))
+			if ( self.midiWriter is None ):
+				midiPath = os.path.splitext(self.writer.path)[0] + ".mid"
+				self.midiWriter = MidiEventWriter(midiPath, 
+												  bpm=int(self.tempo.get()))
+				self.midiSeconds = 0.0
+			# Carry on from where the last take stopped; a pause ends any note
+			self.midiWriter.noteOff(self.midiSeconds)
+			self.midiStart = self.midiSeconds
+			self.setSmoothing()
 
 			# Start
-			self.noteBuffer = []
-			if ( not self.recordingTimer.isAlive() ):
-				self.recordingTimer.start()
+			self.pipeline.begin(self.builder)
 			self.recordingLabel.configure({"bg": "red", "text":"REC"})
 		else:
 			tkMessageBox.showerror("Oops", "You're already recording.")
@@ -135,7 +131,7 @@ class AudioTranscription(Frame):
 		if ( self.recording ):		
 			self.recording = False
 			self.paused = True
-			self.recordingTimer.pause()
+			self.pipeline.pause()
 
 			self.recordBtn.configure({'state': NORMAL})
 			self.pauseBtn.configure({'state': DISABLED})
@@ -148,11 +144,7 @@ class AudioTranscription(Frame):
 		if ( self.recording ):
 			self.recording = False
 			self.paused = False		
-			self.updateSheetDisplay()
-			if ( self.recordingTimer.isAlive() and not self.recordingTimer.paused):
-				self.recordingTimer.pause()
-				# self.recordingTimer.stop()
-				# self.recordingTimer.join()
+			self.pipeline.pause()
 			# Actually stop
 			self.recordingLabel.configure({'bg':'lightblue', "text":"STOPPED"})
 			self.recordBtn.configure({'state': NORMAL})
@@ -171,19 +163,29 @@ class AudioTranscription(Frame):
 			self.initSheetDisplay() # Clear display
 			
 	def export(self): 
-		"""Export the transcribed music."""
+		"""Export the transcribed music, in every format ticked, next to
+		the save file. Runs in the background; see pollExport()."""
 		if ( self.saveFileStr.get() not in self.saveDefault ):
-			# Set the tempo
-			tempoObject = tempo.MetronomeMark( None, 
-												int(self.tempo.get()), 
-												note.QuarterNote() )
-			self.transcribedPart.insert(tempoObject)
-			
-			# Write to disk
-			success = self.transcribedPart.write(fp=self.saveFile)
-			if ( success ):
-				saveMsg = "Your file has been saved to %s." % success
-				tkMessageBox.showinfo("File saved!", saveMsg )
+			formats = [format for (format, ticked) in self.exportFormats
+					   if ticked.get()]
+			if ( len(formats) == 0 ):
+				tkMessageBox.showerror("Oops", "Tick a format to export to.")
+				return
+			basePath = os.path.splitext(self.saveFile)[0]
+			if ( self.writer is not None and self.writer.measureCount > 0 ):
+				# The whole score is only on disk, tempo and all
+				self.writer.checkpoint()
+				self.exporter.export(self.writer.path, basePath, formats)
+			else:
+				# Nothing streamed yet; snapshot what's on screen
+				tempoObject = tempo.MetronomeMark(number=int(self.tempo.get()))
+				self.transcribedPart.insert(tempoObject)
+				(handle, snapshot) = tempfile.mkstemp(suffix=".xml")
+				os.close(handle)
+				self.transcribedPart.write("musicxml", fp=snapshot)
+				self.exporter.export(snapshot, basePath, formats)
+				os.remove(snapshot)
+			self.exportStatus.set("Exporting...")
 		elif ( self.saveFileStr.get() == "" ):
 			self.saveFileStr.set(self.saveDefault)		
 			pass
@@ -191,100 +193,99 @@ class AudioTranscription(Frame):
 			# Don't have a save location... should get that
 			self.getSavePath()
 			self.export()
-	
-	def timePassed(self, seconds):
-		return self.recordingTimer.firedCounter % (15*seconds) == 0
 
-	def timerFired(self):
-		if ( self.recording ):
-			if ( self.timePassed(1) ):
-				self.recordingTimer.seconds += 1
-				recText = {"text": "REC: %02d sec" % self.recordingTimer.seconds }
-				self.recordingLabel.configure( recText )
-			
-			if ( len(self.noteBuffer) == self.measureTimerTicks ):
-				self.processBuffer(self.noteBuffer)
-				self.noteBuffer = [] # Clear the buffer
-				
-			# Fetch audio
-			self.listener.averagePitch()
+	def pollExport(self):
+		"""Report on exports as they finish (from poll())."""
+		results = self.exporter.poll()
+		if ( len(results) == 0 ):
+			return
+		self.exportResults.extend(results)
+		done = ", ".join([format for (format, path, error) in self.exportResults])
+		self.exportStatus.set("Exported: %s" % done)
+		if ( not self.exporter.busy ):
+			saved = [path for (format, path, error) in self.exportResults
+					 if error is None]
+			failed = ["%s (%s)" % (format, error) 
+					  for (format, path, error) in self.exportResults if error]
+			self.exportResults = []
+			if ( failed ):
+				tkMessageBox.showerror("Export failed", "\n".join(failed))
+			if ( saved ):
+				saveMsg = "Your files have been saved:\n%s" % "\n".join(saved)
+				tkMessageBox.showinfo("File saved!", saveMsg )
+	
+	def setSmoothing(self):
+		"""Hand the "Smooth Input Audio" setting to the audio thread."""
+		self.pipeline.smoothing = bool(self.heavyFiltering.get())
 
-			# Add to note buffer: 1 measure's worth of audio
-			if ( self.listener.detectedPitch ):
-				theNote = note.Note(self.listener.pitch.note)
-				self.noteBuffer.append(theNote)
-			else:
-				self.noteBuffer.append(None)	
+	def poll(self):
+		"""Apply whatever the audio thread has sent since the last poll. 
+		Runs on the Tk main loop, so this is the only place recording 
+		changes the UI."""
+		measures = []
+		try:
+			while True:
+				(kind, value) = self.pipeline.events.get_nowait()
+				if ( kind == "measure" ):
+					measures.append(value)
+				elif ( kind == "estimate" and self.midiWriter is not None ):
+					(seconds, midi, onset) = value
+					self.midiSeconds = self.midiStart + seconds
+					self.midiWriter.update(self.midiSeconds, midi, onset)
+				elif ( kind == "seconds" and self.recording ):
+					recText = {"text": "REC: %02d sec" % value }
+					self.recordingLabel.configure( recText )
+				elif ( kind == "ended" ):
+					self.stop()
+		except Queue.Empty:
+			pass
+		if ( measures ):
+			self.addMeasures(measures)
+		self.updateSheetDisplay()
+		self.pollExport()
+		self.root.after(self.pollDelay, self.poll)
 
-	def processBuffer(self, noteBuffer):
-		"""Process the recorded note buffer and turn it into
-		a new music21.stream.Measure() for insertion into the
-		transcribed score.
+	def addMeasures(self, measures):
+		"""Insert finished music21.stream.Measure()s into the
+		transcribed score, and have it re-rendered. Each one is written 
+		out to the session file straight away, and the oldest are let go
+		of once there are more than keepMeasures.
 		"""
+		if ( self.writer is None ):
+			return # left over from a session that's been reset
+		for measure in measures:
+			self.writer.write(measure)
+			self.transcribedPart.append(measure)
+		kept = self.transcribedPart.getElementsByClass("Measure")
+		for measure in list(kept)[:-self.keepMeasures]:
+			self.transcribedPart.remove(measure)
+		self.renderer.append(measures)
 
-		measureBySixteenths = Util.chunks(noteBuffer, 
-										  int(self.sixteenthTimerTicks))
+	def sessionPath(self):
+		"""Where to stream a new recording session. The file is created
+		here, under a name no other session has, so two sessions started
+		within the same second can't overwrite each other."""
+		if ( not os.path.isdir(self.sessionDirectory) ):
+			os.makedirs(self.sessionDirectory)
+		(handle, path) = tempfile.mkstemp(suffix=".xml", 
+						prefix=time.strftime("%Y%m%d-%H%M%S-"),
+						dir=self.sessionDirectory)
+		os.close(handle)
+		return path
 
-		# Are the samples for each 16th note chunk predominantly 
-		# None (rest) or predominantly a note?
-		measureByMaxNote = [max(Util.counter(note16th)) 
-							for note16th in measureBySixteenths]
-		# Get each note with its corresponding length in terms of 
-		# 16th beats.					
-		measureByNoteGroup = [ ( elem, len(list(grouper)) ) 
-						 for elem, grouper in groupby(measureByMaxNote) ]
-		measure = stream.Measure()					
-		# Build the new measure
-		for (elem, noteLen) in measureByNoteGroup:
-			if ( isinstance(elem, note.Note) ):
-				# a 16th note is 1/4 a quarter note
-				if ( self.heavyFiltering.get() ):
-					# smooth to nearest eighth
-					noteLen = Util.stepround(noteLen, 2)
-				elem.quarterLength = (1.0/4.0) * noteLen					
-				measure.insert(elem)
-			else:
-				rest = note.Rest(quarterLength=noteLen)
-				measure.insert(rest)		
-				
-		measureLength = len(measure)			
-		if ( measureLength > 1 and self.heavyFiltering.get() ):
-			# Filter out octave jumps
-			self.listener.windowLength = 5
-			pleasePop = []
-			for i in xrange(measureLength):
-				current = measure[i]
-				if ( i == 0 ):
-					next = measure[1]
-					prev = None
-				elif ( i == measureLength - 1 )	:
-					prev = measure[i-1]
-					next = None
-				else:
-					prev = measure[i-1]	
-					next = measure[i+1]
-				noteSequence = (isinstance(current, note.Note) 
-								and isinstance(next, note.Note)
-						 		and isinstance(prev, note.Note) )
-
-				if ( noteSequence ):
-					octaveJump = ((prev.octave == next.octave) and 
-									(current.octave != prev.octave))
-					if ( octaveJump ): pleasePop.append(i)
-			for i in pleasePop: measure.pop(i)		
-				
-				
-		# You don't want too many ledger lines...
-		octaves = [n.octave for n in measure if isinstance(n, note.Note)]
-		if ( len(octaves) > 0 and min(octaves) < 4 ): 
-			measure.insert(clef.BassClef())
-		else:
-			measure.insert(clef.TrebleClef())	
-			
-		self.transcribedPart.insert(measure)	
-		self.updateSheetDisplay()
+	def closeSession(self):
+		"""Finish the session's MusicXML and MIDI files."""
+		if ( self.writer is not None ):
+			self.writer.close()
+			self.writer = None
+		if ( self.midiWriter is not None ):
+			self.midiWriter.close(self.midiSeconds)
+			self.midiWriter = None
 
 	def initSheetDisplay(self):
+		# A new sheet is a new session
+		self.closeSession()
+
 		# Initialize transcription container
 		self.transcribedPart = stream.Part()
 		defaultMeasure = stream.Measure()
@@ -292,18 +293,21 @@ class AudioTranscription(Frame):
 		self.transcribedPart.insert(defaultMeasure)
 		
 		# Render image
-		self.updateSheetDisplay()
+		self.renderer.reset([defaultMeasure])
 			
 	def updateSheetDisplay(self):
-		"""Render (or re-render) the transcribed score into sheet music."""
-		# Re-render the sheet music
-		self.sheetPath = self.transcribedPart.write("lily.png")
-		_image = Image.open(self.sheetPath)
-		# Scale to fit in window.
-		scale = tuple([int(round(dim*0.6)) for dim in _image.size])
-
-		self.sheetImg = ImageTk.PhotoImage(_image.resize(scale, 
-															Image.ANTIALIAS))
+		"""Show the newest sheet music the renderer has finished, if
+		there's anything new. Main thread only (ImageTk isn't thread
+		safe)."""
+		_image = None
+		try:
+			while True:
+				_image = self.renderer.results.get_nowait()
+		except Queue.Empty:
+			pass
+		if ( _image is None ):
+			return
+		self.sheetImg = ImageTk.PhotoImage(_image)
 		# Update the panel
 		if ( self.justLaunched ):
 			# Pack image and display
@@ -313,11 +317,17 @@ class AudioTranscription(Frame):
 			
 		self.panel.configure(image=self.sheetImg)
 
-	def initAudio(self):
-		"""Initialize pitch detection and transcription."""
+	def initAudio(self, listener=None):
+		"""Initialize pitch detection and transcription, using listener
+		if one has already been started (e.g. a RemoteListener)."""
 		# Initialize pitch detection
-		self.listener = PitchDetect(channels=1)
-		self.listener.listen()
+		if ( listener is not None ):
+			self.listener = listener
+		else:
+			self.listener = PitchDetect(channels=1, queueSize=8,
+										policy="drop-oldest")
+			self.listener.listen()
+		self.pipeline = TranscriptionPipeline(self.listener)
 		self.recording = False
 		self.paused = False
 
@@ -341,7 +351,8 @@ class AudioTranscription(Frame):
 			self.heavyFiltering = IntVar()
 			filtering = Checkbutton(self.controlButtons, 
 									text="Smooth Input Audio", 
-									variable=self.heavyFiltering)				
+									variable=self.heavyFiltering,
+									command=self.setSmoothing)				
 			tempoLabel = Label(self.controlButtons, text="Intended tempo: ")
 			self.recordingLabel = Label(self.controlButtons, text="STOPPED", 
 										fg="white", bg="lightblue")
@@ -367,6 +378,18 @@ class AudioTranscription(Frame):
 									textvariable=self.saveFileStr)
 			export = Button(self.bottomButtons, text="Export", 
 							command=self.export)
+			names = {"musicxml": "XML", "midi": "MIDI", 
+					 "lily.pdf": "PDF", "lily.png": "PNG"}
+			self.exportFormats = []
+			formatButtons = []
+			for (format, extension) in exporter.formats:
+				ticked = IntVar(self.root, 1 if format == "musicxml" else 0)
+				self.exportFormats.append((format, ticked))
+				formatButtons.append(Checkbutton(self.bottomButtons, 
+								text=names[format], variable=ticked))
+			self.exportStatus = StringVar(self.root, "")
+			exportStatus = Label(self.bottomButtons, 
+								 textvariable=self.exportStatus)
 			reset = Button(self.bottomButtons, text="Reset", 
 							command=self.reset)
 			quit = Button(self.bottomButtons, text="Quit", 
@@ -375,7 +398,10 @@ class AudioTranscription(Frame):
 			# Pack buttons
 			fileName.pack(side=LEFT)
 			self.fileLoc.pack(side=LEFT)
+			for button in formatButtons:
+				button.pack(side=LEFT)
 			export.pack(side=LEFT, **self.buttonOptions)
+			exportStatus.pack(side=LEFT)
 			reset.pack(side=LEFT, **self.buttonOptions)
 			quit.pack(side=LEFT, **self.buttonOptions)
 			
@@ -392,5 +418,11 @@ class AudioTranscription(Frame):
 		self.root.mainloop()
 
 if __name__ == '__main__':	
-	transcription = AudioTranscription()
+	import argparse
+	parser = argparse.ArgumentParser(description="Live transcription.")
+	parser.add_argument("--process", action="store_true",
+						help="run audio capture and pitch detection in a "
+							 "separate process")
+	args = parser.parse_args()
+	transcription = AudioTranscription(detectorProcess=args.process)
 	transcription.run()